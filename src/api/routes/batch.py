@@ -0,0 +1,129 @@
+# src/api/routes/batch.py
+"""
+Batch gateway: many logical requests in one HTTP round-trip
+"""
+
+import asyncio
+import orjson
+from fastapi import APIRouter, Request
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+router = APIRouter(tags=["batch"])
+
+MAX_BATCH_REQUESTS = 64   # Максимум вложенных запросов в одном батче
+API_PREFIX = "/v1"
+
+class BatchItem(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
+    path: str  # e.g. "/embeddings" or "/v1/chat/completions"
+    method: str = "POST"
+    body: Optional[Dict[str, Any]] = None
+
+class BatchRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
+    # Oversized batches are rejected with 422 during request validation
+    requests: Annotated[Dict[str, BatchItem], Field(max_length=MAX_BATCH_REQUESTS)]
+
+def _resolve_path(path: str) -> str:
+    """Пути без префикса считаются относительными к /v1"""
+    if not path.startswith("/"):
+        path = "/" + path
+    if not path.startswith(API_PREFIX + "/"):
+        path = API_PREFIX + path
+    return path
+
+async def _call_asgi(request: Request, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+    """
+    Выполняет вложенный запрос напрямую через ASGI-приложение, без сети и HTTP-клиента
+    Возвращает (статус, тело ответа)
+    """
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": "1.1",
+        "method": method,
+        "scheme": request.scope.get("scheme", "http"),
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+    }
+    if "state" in request.scope:
+        scope["state"] = request.scope["state"]
+
+    response_done = asyncio.Event()
+    body_sent = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Отключение "клиента" только после полного ответа - иначе стриминг оборвется
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    status = 500
+    chunks: List[bytes] = []
+    content_type = b""
+
+    async def send(message: Dict[str, Any]):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                if name.lower() == b"content-type":
+                    content_type = value
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+
+    try:
+        await request.app(scope, receive, send)
+    finally:
+        response_done.set()
+
+    raw = b"".join(chunks)
+    if content_type.startswith(b"application/json") and raw:
+        return status, orjson.loads(raw)
+    return status, raw.decode("utf-8", errors="replace")
+
+@router.post("/batch")
+async def batch_requests(batch: BatchRequest, request: Request):
+    """
+    Execute many API requests in one round-trip
+
+    - **requests**: mapping of client id to {"path", "method", "body"}
+
+    Sub-requests run concurrently, so /embeddings calls coalesce
+    in the dynamic batcher. Returns {id: {"status", "body"}}.
+    """
+    logger.info(f"Batch gateway request with {len(batch.requests)} sub-requests")
+
+    async def run(item: BatchItem) -> Dict[str, Any]:
+        path = _resolve_path(item.path)
+        # Батч внутри батча запрещен - иначе лимит обходится рекурсией
+        if path == API_PREFIX + "/batch":
+            return {"status": 400, "body": {"detail": "Nested batch requests are not allowed"}}
+        try:
+            body = orjson.dumps(item.body) if item.body is not None else b""
+            status, content = await _call_asgi(request, item.method.upper(), path, body)
+            return {"status": status, "body": content}
+        except Exception as e:
+            logger.error(f"Batch sub-request {path} error: {e}")
+            return {"status": 500, "body": {"detail": "Internal server error"}}
+
+    ids = list(batch.requests.keys())
+    results = await asyncio.gather(*(run(batch.requests[request_id]) for request_id in ids))
+    return dict(zip(ids, results))
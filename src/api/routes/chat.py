@@ -3,22 +3,47 @@
 OpenAI-compatible chat endpoints
 """
 
+import time
+import itertools
+import orjson
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, AsyncIterator, List, Optional, Dict, Any
 from loguru import logger
 
+from services.batching import BatcherOverloaded
 from services.llm_service import llm_service
+from services.llm_batcher import llm_batcher
+from services.response_cache import chat_cache
+from services.semantic_cache import semantic_cache
+
+# Порядковый номер ответа: id уникален даже в пределах одной секунды
+_completion_counter = itertools.count()
+
+def _completion_id(created: int) -> str:
+    return f"chatcmpl-{created}-{next(_completion_counter)}"
 
 router = APIRouter(tags=["chat"])
 
+MAX_CHAT_MESSAGES = 2048
+
+# OpenAI clients send extra fields (top_p, name, ...) - they are ignored, not rejected.
+# Frozen: request objects are never mutated after validation
+_OPENAI_REQUEST_CONFIG = ConfigDict(extra='ignore', frozen=True)
+
 class ChatMessage(BaseModel):
+    model_config = _OPENAI_REQUEST_CONFIG
+
     role: str
     content: str
 
 class ChatRequest(BaseModel):
+    model_config = _OPENAI_REQUEST_CONFIG
+
     model: str  # Required in OpenAI format
-    messages: List[ChatMessage]
+    # Oversized histories are rejected before the whole list is validated
+    messages: Annotated[List[ChatMessage], Field(max_length=MAX_CHAT_MESSAGES)]
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = None
     stream: Optional[bool] = False
@@ -32,7 +57,51 @@ class ChatResponse(BaseModel):
     choices: List[Dict[str, Any]]
     usage: Dict[str, int]
 
-@router.post("/completions", response_model=ChatResponse)
+def _sse_chunk(completion_id: str, created: int, model: str, delta: Dict[str, Any],
+               finish_reason: Optional[str] = None) -> bytes:
+    """One server-sent event in the OpenAI chat.completion.chunk format"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+async def _stream_chat_completion(request: ChatRequest, messages_dict: List[Dict[str, str]],
+                                  max_tokens: int) -> StreamingResponse:
+    """
+    Stream tokens as they are generated (SSE)
+    The first token is awaited before the response starts so service errors still map to HTTP 400
+    """
+    tokens = llm_service.stream_chat_completion(
+        messages=messages_dict,
+        model_name=request.model,
+        temperature=request.temperature,
+        max_tokens=max_tokens
+    )
+    
+    try:
+        first_token = await anext(tokens)
+    except StopAsyncIteration:
+        first_token = ""
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    created = int(time.time())
+    completion_id = _completion_id(created)
+    
+    async def event_stream() -> AsyncIterator[bytes]:
+        yield _sse_chunk(completion_id, created, request.model, {"role": "assistant", "content": first_token})
+        async for token in tokens:
+            yield _sse_chunk(completion_id, created, request.model, {"content": token})
+        yield _sse_chunk(completion_id, created, request.model, {}, finish_reason="stop")
+        yield b"data: [DONE]\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@router.post("/completions", response_model=ChatResponse, response_class=ORJSONResponse)
 async def create_chat_completion(request: ChatRequest):
     """
     Create chat completion compatible with OpenAI API
@@ -45,31 +114,56 @@ async def create_chat_completion(request: ChatRequest):
     try:
         logger.info(f"OpenAI chat completion request for model: {request.model}")
         
-        # Convert to service format
-        messages_dict = [msg.dict() for msg in request.messages]
+        # Convert to service format: one pydantic-core pass over the whole history
+        messages_dict = request.model_dump(include={"messages"})["messages"]
+        
+        max_tokens = request.max_tokens or 500
+        
+        # Streaming bypasses the batcher and caches - tokens go straight to the client
+        if request.stream:
+            return await _stream_chat_completion(request, messages_dict, max_tokens)
+        
+        # Запрос уходит в общую очередь: при перегрузке - 429, а не бесконечное ожидание
+        def generate():
+            return llm_batcher.submit(
+                messages_dict,
+                model_name=request.model,
+                temperature=request.temperature,
+                max_tokens=max_tokens
+            )
         
-        result = await llm_service.chat_completion(
-            messages=messages_dict,
-            model_name=request.model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens or 500
-        )
+        # Кешируем только детерминированную генерацию (temperature=0):
+        # сначала точное совпадение, затем близкий по смыслу вопрос
+        if request.temperature == 0:
+            cache_key = chat_cache.make_key(request.model, request.temperature, max_tokens, messages_dict)
+            result = await chat_cache.get_or_compute(
+                cache_key,
+                lambda: semantic_cache.get_or_compute(request.model, max_tokens, messages_dict, generate),
+                cacheable=lambda r: "error" not in r
+            )
+        else:
+            result = await generate()
         
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
         
-        # Transform to OpenAI format
-        import time
-        return ChatResponse(
-            id=f"chatcmpl-{int(time.time())}",
-            created=int(time.time()),
-            model=result["model"],
-            choices=result["choices"],
-            usage=result["usage"]
-        )
+        # Transform to OpenAI format: the service output is already shaped,
+        # a Response return skips response_model validation
+        created = int(time.time())
+        return ORJSONResponse(content={
+            "id": _completion_id(created),
+            "object": "chat.completion",
+            "created": created,
+            "model": result["model"],
+            "choices": result["choices"],
+            "usage": result["usage"]
+        })
         
     except HTTPException:
         raise
+    except BatcherOverloaded as e:
+        logger.warning(f"OpenAI chat completion rejected: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": e.retry_after_header})
     except Exception as e:
         logger.error(f"OpenAI chat completion error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
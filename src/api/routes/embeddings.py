@@ -3,19 +3,32 @@
 OpenAI-compatible embeddings endpoints
 """
 
+import base64
+import numpy as np
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, List, Literal, Optional, Dict, Any
 from loguru import logger
 
-from services.embedding_service import embedding_service
+from services.batching import BatcherOverloaded
+from services.batch_processor import approx_token_count
+from services.embedding_batcher import embedding_batcher
+from services.response_cache import embedding_cache
 
 router = APIRouter(tags=["embeddings"])
 
+MAX_EMBEDDING_INPUTS = 2048  # Same limit as the OpenAI API
+
 class EmbeddingRequest(BaseModel):
-    input: List[str]  # OpenAI format
+    # OpenAI clients may send extra fields (dimensions, ...) - ignored, not rejected
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+    input: Annotated[List[str], Field(max_length=MAX_EMBEDDING_INPUTS)]  # OpenAI format
     model: str  # Required in OpenAI format
     user: Optional[str] = None
+    # float - JSON-массив; base64 - float32 как в OpenAI; float16/int8 - компактнее в 2/4 раза
+    encoding_format: Literal["float", "base64", "float16", "int8"] = "float"
 
 class EmbeddingResponse(BaseModel):
     object: str = "list"
@@ -23,7 +36,72 @@ class EmbeddingResponse(BaseModel):
     model: str
     usage: dict
 
-@router.post("/embeddings", response_model=EmbeddingResponse)
+def _encode_embedding(embedding: np.ndarray, index: int, encoding_format: str) -> Dict[str, Any]:
+    """
+    Сериализация одного вектора в выбранный формат
+    Клиент декодирует через np.frombuffer(base64.b64decode(...), dtype)
+    """
+    item: Dict[str, Any] = {"object": "embedding", "index": index}
+    if encoding_format == "float":
+        item["embedding"] = embedding
+        return item
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    if encoding_format == "int8":
+        # Симметричное квантование по вектору: embedding ≈ q * scale
+        max_abs = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = max_abs / 127 if max_abs > 0 else 1.0
+        vector = np.round(vector / scale).astype(np.int8)
+        item["scale"] = scale
+    elif encoding_format == "float16":
+        vector = vector.astype(np.float16)
+
+    item["embedding"] = base64.b64encode(vector.tobytes()).decode('ascii')
+    return item
+
+def _format_embeddings(data: List[Dict[str, Any]], encoding_format: str) -> List[Dict[str, Any]]:
+    if encoding_format == "float":
+        return data
+    return [_encode_embedding(item["embedding"], item["index"], encoding_format) for item in data]
+
+async def _get_embeddings_cached(texts: List[str], model_name: str) -> Dict[str, Any]:
+    """
+    Эмбеддинги с кешем по каждому тексту отдельно:
+    попадания берутся из кеша, в модель уходят только промахи
+    """
+    keys = [embedding_cache.make_key(model_name, text) for text in texts]
+    embeddings = [embedding_cache.get(key) for key in keys]
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    
+    if misses:
+        # Запрос уходит в общую очередь и считается вместе с соседними
+        result = await embedding_batcher.submit(
+            texts=[texts[i] for i in misses],
+            model_name=model_name
+        )
+        if "error" in result:
+            return result
+        
+        for i, item in zip(misses, result["data"]):
+            embeddings[i] = item["embedding"]
+            # Строка - view всего массива батча; копия, чтобы кеш не держал батч целиком
+            embedding_cache.set(keys[i], item["embedding"].copy())
+    
+    total_tokens = approx_token_count(texts)
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "embedding": embedding, "index": i}
+            for i, embedding in enumerate(embeddings)
+        ],
+        "model": model_name,
+        "usage": {
+            "prompt_tokens": total_tokens,
+            "total_tokens": total_tokens
+        }
+    }
+
+@router.post("/embeddings", response_model=EmbeddingResponse, response_class=ORJSONResponse)
 async def create_embeddings(request: EmbeddingRequest):
     """
     Create embeddings compatible with OpenAI API
@@ -31,14 +109,13 @@ async def create_embeddings(request: EmbeddingRequest):
     - **input**: List of texts to embed
     - **model**: Model name (required)
     - **user**: Optional user ID
+    - **encoding_format**: float (default), base64 (float32), float16 or int8 (base64 + per-vector scale)
     """
     try:
-        logger.info(f"OpenAI embeddings request for {len(request.input)} texts")
+        # Per-request log at DEBUG with lazy formatting - not built on the hot path
+        logger.debug("OpenAI embeddings request for {} texts", len(request.input))
         
-        result = await embedding_service.get_embeddings(
-            texts=request.input,
-            model_name=request.model
-        )
+        result = await _get_embeddings_cached(request.input, request.model)
         
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -46,12 +123,14 @@ async def create_embeddings(request: EmbeddingRequest):
         # 🔴 ИСПРАВЛЕНИЕ: embedding_service теперь возвращает OpenAI формат
         # Проверяем есть ли данные в поле "data" (OpenAI) или "embeddings" (старый)
         if "data" in result:
-            # Уже в OpenAI формате - возвращаем как есть
-            return EmbeddingResponse(
-                data=result["data"],
-                model=result["model"],
-                usage=result.get("usage", {"prompt_tokens": 0, "total_tokens": 0})
-            )
+            # Уже в OpenAI формате - возвращаем как есть, без повторной
+            # валидации pydantic по каждому float вектора
+            return ORJSONResponse(content={
+                "object": "list",
+                "data": _format_embeddings(result["data"], request.encoding_format),
+                "model": result["model"],
+                "usage": result.get("usage", {"prompt_tokens": 0, "total_tokens": 0})
+            })
         elif "embeddings" in result:
             # Старый формат - конвертируем в OpenAI
             embeddings_data = []
@@ -62,19 +141,23 @@ async def create_embeddings(request: EmbeddingRequest):
                     "index": i
                 })
             
-            return EmbeddingResponse(
-                data=embeddings_data,
-                model=result["model"],
-                usage={
+            return ORJSONResponse(content={
+                "object": "list",
+                "data": _format_embeddings(embeddings_data, request.encoding_format),
+                "model": result["model"],
+                "usage": {
                     "prompt_tokens": result.get("texts_processed", len(request.input)),
                     "total_tokens": result.get("texts_processed", len(request.input))
                 }
-            )
+            })
         else:
             raise HTTPException(status_code=500, detail="Invalid response format from embedding service")
         
     except HTTPException:
         raise
+    except BatcherOverloaded as e:
+        logger.warning(f"OpenAI embeddings rejected: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": e.retry_after_header})
     except Exception as e:
         logger.error(f"OpenAI embeddings error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
@@ -5,31 +5,35 @@ Web interface for model management
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from pathlib import Path
+from jinja2 import FileSystemBytecodeCache
 import os
 
+from path_fix import PROJECT_ROOT
+
 router = APIRouter()
 
 # Template configuration - FIXED PATH
-BASE_DIR = Path(__file__).parent.parent.parent.parent  # Go up to project root
+BASE_DIR = PROJECT_ROOT
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Шаблоны не меняются во время работы - без stat() файла на каждый рендер
+templates.env.auto_reload = False
+# Скомпилированные шаблоны переживают перезапуск, исходник парсится один раз
+templates.env.bytecode_cache = FileSystemBytecodeCache(str(BASE_DIR / ".jinja_cache"))
+
+# Шаблоны разрешаются один раз при импорте, а не на каждый запрос
+_dashboard_tpl = templates.get_template("model_dashboard.html")
+_models_list_tpl = templates.get_template("models_list.html")
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def model_dashboard(request: Request):
     """
     Main model dashboard page
     """
-    return templates.TemplateResponse(
-        "model_dashboard.html",
-        {"request": request}
-    )
+    return HTMLResponse(_dashboard_tpl.render(request=request))
 
 @router.get("/dashboard/models", response_class=HTMLResponse)
 async def models_list(request: Request):
     """
     Models list page with cards
     """
-    return templates.TemplateResponse(
-        "models_list.html",
-        {"request": request}
-    )
\ No newline at end of file
+    return HTMLResponse(_models_list_tpl.render(request=request))
\ No newline at end of file
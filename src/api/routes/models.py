@@ -3,13 +3,17 @@
 OpenAI-совместимые models endpoints + кастомные эндпоинты управления
 """
 
+import time
+import asyncio
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, FrozenSet, Optional, Tuple
 from loguru import logger
 
 from services.model_manager import model_manager
 from services.model_discovery import model_discovery
+from services.quantization_service import quantization_service
 
 router = APIRouter(tags=["models"])
 
@@ -23,15 +27,58 @@ class ModelsListResponse(BaseModel):
     object: str = "list"
     data: List[ModelResponse]
 
+# Internal management API: unknown fields are a client error
+_INTERNAL_REQUEST_CONFIG = ConfigDict(extra='forbid', frozen=True)
+
 class LoadModelRequest(BaseModel):
+    model_config = _INTERNAL_REQUEST_CONFIG
+
     model_name: str
     model_type: str  # "embedding" or "llm"
 
 class DownloadModelRequest(BaseModel):
+    model_config = _INTERNAL_REQUEST_CONFIG
+
     model_id: str  # Format: "author/model-name"
 
+# === КЕШ СКАНИРОВАНИЯ ===
+SCAN_CACHE_TTL = 5.0  # секунд
+
+# (время сканирования, результат, множество имен моделей)
+_scan_cache: Optional[Tuple[float, Dict[str, Any], FrozenSet[str]]] = None
+
+async def _scan() -> Tuple[Dict[str, Any], FrozenSet[str]]:
+    """
+    Результат model_discovery.scan_models_cache с TTL-кешем
+    Обход диска выполняется в потоке, чтобы не блокировать event loop
+    """
+    global _scan_cache
+    now = time.monotonic()
+    if _scan_cache is not None and now - _scan_cache[0] < SCAN_CACHE_TTL:
+        return _scan_cache[1], _scan_cache[2]
+    
+    result = await asyncio.to_thread(model_discovery.scan_models_cache)
+    # Множество строится один раз на сканирование: проверка наличия модели - O(1)
+    names = frozenset(model["name"] for model in result.get("models", []))
+    if "error" not in result:
+        _scan_cache = (now, result, names)
+    return result, names
+
+async def _scan_models_cache() -> Dict[str, Any]:
+    result, _ = await _scan()
+    return result
+
+async def _cached_model_names() -> FrozenSet[str]:
+    _, names = await _scan()
+    return names
+
+def _invalidate_scan_cache():
+    """Сброс кеша сканирования после изменений в кеше моделей"""
+    global _scan_cache
+    _scan_cache = None
+
 # === OPENAI-СОВМЕСТИМЫЕ ЭНДПОИНТЫ ===
-@router.get("/models", response_model=ModelsListResponse)
+@router.get("/models", response_model=ModelsListResponse, response_class=ORJSONResponse)
 async def list_models():
     """
     List available models (OpenAI-compatible)
@@ -39,19 +86,21 @@ async def list_models():
     """
     try:
         # Get ONLY locally cached models
-        cache_info = model_discovery.scan_models_cache()
+        cache_info = await _scan_models_cache()
         models_data = []
         
         for model in cache_info.get("models", []):
             # ФИЛЬТРУЕМ: оставляем ТОЛЬКО стандартные форматы HF
             if model["name"].startswith('models--'):
-                models_data.append(ModelResponse(
-                    id=model["name"],  # Use the actual cached name
-                    created=1700000000,
-                    owned_by="tamivla"
-                ))
+                models_data.append({
+                    "id": model["name"],  # Use the actual cached name
+                    "object": "model",
+                    "created": 1700000000,
+                    "owned_by": "tamivla"
+                })
         
-        return ModelsListResponse(data=models_data)
+        # Plain dicts: no per-model pydantic construction and re-validation
+        return ORJSONResponse(content={"object": "list", "data": models_data})
         
     except Exception as e:
         logger.error(f"Error listing models: {e}")
@@ -63,8 +112,12 @@ async def load_model(request: LoadModelRequest):
     """Load model into memory - ONLY if exists locally"""
     try:
         # Check if model exists locally first
-        cache_info = model_discovery.scan_models_cache()
-        available_models = [model["name"] for model in cache_info.get("models", [])]
+        available_models = await _cached_model_names()
+        
+        # Модель могли положить в кеш после последнего сканирования - пересканируем
+        if request.model_name not in available_models:
+            _invalidate_scan_cache()
+            available_models = await _cached_model_names()
         
         if request.model_name not in available_models:
             raise HTTPException(
@@ -72,10 +125,10 @@ async def load_model(request: LoadModelRequest):
                 detail=f"Model {request.model_name} not found in local cache"
             )
         
-        success = model_manager.load_model(
-            model_name=request.model_name,
-            model_type=request.model_type
-        )
+        # Чтение весов с диска - в потоке, event loop продолжает обслуживать запросы
+        success = await model_manager.load_model_async(request.model_name, request.model_type)
+        # Рекомендации по квантованию зависят от свободной VRAM
+        quantization_service.invalidate_cache()
         
         if success:
             return {
@@ -96,7 +149,8 @@ async def load_model(request: LoadModelRequest):
 async def unload_model(model_name: str):
     """Unload model from memory"""
     try:
-        success = model_manager.unload_model(model_name)
+        success = await asyncio.to_thread(model_manager.unload_model, model_name)
+        quantization_service.invalidate_cache()
         
         if success:
             return {
@@ -129,7 +183,8 @@ async def download_model(request: DownloadModelRequest):
     try:
         logger.info(f"Downloading model: {request.model_id}")
         
-        success = model_discovery.download_model(request.model_id)
+        success = await asyncio.to_thread(model_discovery.download_model, request.model_id)
+        _invalidate_scan_cache()
         
         if success:
             return {
@@ -148,12 +203,13 @@ async def download_model(request: DownloadModelRequest):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 # === НОВЫЕ КАСТОМНЫЕ ЭНДПОИНТЫ ДЛЯ КЕША ===
-@router.get("/cache/info")
+@router.get("/cache/info", response_class=ORJSONResponse)
 async def get_cache_info():
     """Получение детальной информации о кеше моделей"""
     try:
-        cache_info = model_discovery.scan_models_cache()
-        return cache_info
+        cache_info = await _scan_models_cache()
+        # orjson сериализует FileInfo (dataclass) сам, без jsonable_encoder по каждому файлу
+        return ORJSONResponse(content=cache_info)
     except Exception as e:
         logger.error(f"Ошибка получения информации о кеше: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -162,7 +218,7 @@ async def get_cache_info():
 async def analyze_cache():
     """Анализ кеша на наличие битых моделей"""
     try:
-        result = model_discovery.analyze_model_cache()
+        result = await asyncio.to_thread(model_discovery.analyze_model_cache)
         return result
     except Exception as e:
         logger.error(f"Ошибка анализа кеша: {e}")
@@ -173,7 +229,9 @@ async def delete_model_from_cache(model_name: str):
     """Удаление модели из локального кеша"""
     try:
         # Используем метод delete_model из model_discovery
-        success = model_discovery.delete_model(model_name)
+        success = await asyncio.to_thread(model_discovery.delete_model, model_name)
+        _invalidate_scan_cache()
+        model_manager.invalidate_local_models()
         
         if success:
             return {
@@ -2,14 +2,60 @@
 Эндпоинты для управления квантованием моделей
 """
 
+import os
+import asyncio
+import itertools
+from collections import Counter
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Sequence
 from loguru import logger
 
-from services.quantization_service import quantization_service
+from services.quantization_service import quantization_service, POPULAR_MODELS
 
-router = APIRouter(prefix="/quantization", tags=["quantization"])
+# orjson: большие пакетные ответы сериализуются в C, а не стандартным json
+router = APIRouter(prefix="/quantization", tags=["quantization"], default_response_class=ORJSONResponse)
+
+# === СЧЕТЧИК ЗАПРОСОВ ===
+# Дашборды опрашивают эндпоинты постоянно: вместо строки лога на каждый запрос -
+# сводка раз в STATS_FLUSH_INTERVAL секунд
+STATS_FLUSH_INTERVAL = 30
+
+_request_counter: Counter = Counter()
+_stats_task: Optional[asyncio.Task] = None
+
+def _log_request_stats(period: str):
+    if _request_counter:
+        logger.info(f"📊 Запросы квантования за {period}: {dict(_request_counter)}")
+        _request_counter.clear()
+
+async def _flush_request_stats():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        _log_request_stats(f"{STATS_FLUSH_INTERVAL}s")
+
+def start_request_stats():
+    """Запуск фоновой сводки запросов (вызывается из lifespan, в цикле событий приложения)"""
+    global _stats_task
+    if _stats_task is None:
+        _stats_task = asyncio.create_task(_flush_request_stats())
+
+async def stop_request_stats():
+    """Остановка сводки; счетчики последнего интервала пишутся в лог, а не теряются"""
+    global _stats_task
+    if _stats_task is not None:
+        _stats_task.cancel()
+        try:
+            await _stats_task
+        except asyncio.CancelledError:
+            pass
+        _stats_task = None
+    _log_request_stats("последний интервал")
+
+def _count_request(endpoint: str):
+    """Учет запроса - только инкремент счетчика"""
+    _request_counter[endpoint] += 1
 
 # Pydantic модели для запросов
 class QuantizationAnalysisRequest(BaseModel):
@@ -37,17 +83,22 @@ async def analyze_model_quantization(request: QuantizationAnalysisRequest):
     - **target_device**: Целевое GPU устройство (по умолчанию: cuda:0)
     """
     try:
-        logger.info(f"Анализ квантования для модели: {request.model_name}")
+        _count_request("analyze")
+        # Формат применяется, только если включен DEBUG
+        logger.debug("Анализ квантования для модели: {}", request.model_name)
         
         # Получаем анализ квантования
         analysis = quantization_service.generate_quantization_suggestions(request.model_name)
         quantization_analysis = analysis["quantization_analysis"]
         
         # Формируем альтернативные рекомендации
-        alternative_recommendations = [
-            rec for rec in quantization_analysis["recommendations"] 
-            if rec["can_fit"] and rec != quantization_analysis["best_recommendation"]
-        ][:3]  # Ограничиваем 3 альтернативами
+        # Сравниваем по уровню, а не по всему словарю; обход прекращается после 3 альтернатив
+        best_level = quantization_analysis["best_recommendation"]["level"]
+        alternative_recommendations = list(itertools.islice(
+            (rec for rec in quantization_analysis["recommendations"]
+             if rec["can_fit"] and rec["level"] != best_level),
+            3
+        ))
         
         return QuantizationSuggestionResponse(
             model_name=analysis["model_name"],
@@ -63,26 +114,38 @@ async def analyze_model_quantization(request: QuantizationAnalysisRequest):
         logger.error(f"Ошибка анализа квантования для {request.model_name}: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
 
+async def _analyze_models(model_names: Sequence[str]) -> List[Any]:
+    """
+    Анализ нескольких моделей параллельно в потоках, event loop не блокируется
+    Ошибка по отдельной модели возвращается как исключение на ее месте
+    """
+    return await asyncio.gather(
+        *(asyncio.to_thread(quantization_service.generate_quantization_suggestions, name) for name in model_names),
+        return_exceptions=True
+    )
+
 @router.post("/analyze-batch")
 async def analyze_batch_quantization(request: BatchQuantizationAnalysisRequest):
     """
     Пакетный анализ нескольких моделей
     """
     try:
-        logger.info(f"Пакетный анализ квантования для {len(request.model_names)} моделей")
+        _count_request("analyze-batch")
+        logger.opt(lazy=True).debug("Пакетный анализ квантования для {} моделей", lambda: len(request.model_names))
+        
+        analyses = await _analyze_models(request.model_names)
         
         results = {}
-        for model_name in request.model_names:
-            try:
-                analysis = quantization_service.generate_quantization_suggestions(model_name)
-                results[model_name] = {
-                    "estimated_size_gb": analysis["estimated_size_gb"],
-                    "can_load": analysis["quantization_analysis"]["can_load"],
-                    "best_recommendation": analysis["quantization_analysis"]["best_recommendation"],
-                    "suggestions": analysis["suggestions"][:3]  # Первые 3 предложения
-                }
-            except Exception as e:
-                results[model_name] = {"error": str(e)}
+        for model_name, analysis in zip(request.model_names, analyses):
+            if isinstance(analysis, Exception):
+                results[model_name] = {"error": str(analysis)}
+                continue
+            results[model_name] = {
+                "estimated_size_gb": analysis["estimated_size_gb"],
+                "can_load": analysis["quantization_analysis"]["can_load"],
+                "best_recommendation": analysis["quantization_analysis"]["best_recommendation"],
+                "suggestions": analysis["suggestions"][:3]  # Первые 3 предложения
+            }
         
         return {
             "total_models": len(request.model_names),
@@ -98,6 +161,7 @@ async def get_detailed_gpu_info():
     """
     Получение детальной информации о GPU
     """
+    _count_request("gpu-info")
     try:
         gpu_info = quantization_service.get_gpu_memory_info()
         return gpu_info
@@ -110,32 +174,24 @@ async def get_popular_models_recommendations():
     """
     Рекомендации по квантованию для популярных моделей
     """
-    popular_models = [
-        "Qwen/Qwen2.5-7B-Instruct",
-        "microsoft/DialoGPT-medium", 
-        "sentence-transformers/all-MiniLM-L6-v2",
-        "sentence-transformers/all-mpnet-base-v2",
-        "intfloat/multilingual-e5-large-instruct",
-        "mistralai/Mistral-7B-Instruct-v0.2",
-        "google/flan-t5-large"
-    ]
-    
+    _count_request("popular-models")
     try:
+        analyses = await _analyze_models(POPULAR_MODELS)
+        
         results = {}
-        for model in popular_models:
-            try:
-                analysis = quantization_service.generate_quantization_suggestions(model)
-                results[model] = {
-                    "estimated_size_gb": analysis["estimated_size_gb"],
-                    "can_load": analysis["quantization_analysis"]["can_load"],
-                    "best_recommendation": analysis["quantization_analysis"]["best_recommendation"]
-                }
-            except Exception as e:
-                results[model] = {"error": str(e)}
+        for model, analysis in zip(POPULAR_MODELS, analyses):
+            if isinstance(analysis, Exception):
+                results[model] = {"error": str(analysis)}
+                continue
+            results[model] = {
+                "estimated_size_gb": analysis["estimated_size_gb"],
+                "can_load": analysis["quantization_analysis"]["can_load"],
+                "best_recommendation": analysis["quantization_analysis"]["best_recommendation"]
+            }
         
         return {
             "popular_models": results,
-            "gpu_info": quantization_service.get_gpu_memory_info()
+            "gpu_info": await asyncio.to_thread(quantization_service.get_gpu_memory_info)
         }
         
     except Exception as e:
@@ -147,6 +203,7 @@ async def get_model_quantization_options(model_name: str):
     """
     Получение всех вариантов квантования для конкретной модели
     """
+    _count_request("quantization-options")
     try:
         model_size = quantization_service.get_model_size_estimation(model_name)
         quantization_analysis = quantization_service.calculate_optimal_quantization(model_size)
@@ -209,14 +266,17 @@ async def list_quantized_models():
     """
     Список уже квантованных моделей
     """
+    _count_request("quantized-models")
     try:
         quantized_models = []
         quantized_dir = quantization_service.quantized_models_cache
         
         if quantized_dir.exists():
-            for model_dir in quantized_dir.iterdir():
-                if model_dir.is_dir():
-                    model_name = model_dir.name
+            with os.scandir(quantized_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    model_name = entry.name
                     # Извлекаем оригинальное имя модели и уровень квантования
                     if '--' in model_name:
                         parts = model_name.split('--')
@@ -228,8 +288,8 @@ async def list_quantized_models():
                                 "original_name": original_name,
                                 "quantized_name": model_name,
                                 "quantization_level": quant_level,
-                                "path": str(model_dir),
-                                "size_mb": quantization_service.get_directory_size_mb(model_dir) if hasattr(quantization_service, 'get_directory_size_mb') else 0
+                                "path": entry.path,
+                                "size_mb": quantization_service.get_directory_size_mb(entry.path)
                             })
         
         return {
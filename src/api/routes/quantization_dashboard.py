@@ -5,20 +5,29 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from pathlib import Path
+from jinja2 import FileSystemBytecodeCache
+
+from path_fix import PROJECT_ROOT
 
 router = APIRouter()
 
 # Настройка шаблонов
-BASE_DIR = Path(__file__).parent.parent.parent.parent  # Go up to project root
+BASE_DIR = PROJECT_ROOT
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Шаблоны не меняются во время работы - без stat() файла на каждый рендер
+templates.env.auto_reload = False
+templates.env.cache_size = 400
+templates.env.bytecode_cache = FileSystemBytecodeCache(str(BASE_DIR / ".jinja_cache"))
+
+# Шаблон компилируется один раз при импорте
+_quantization_tpl = templates.get_template("quantization_dashboard.html")
+# Шаблон не использует переменных запроса - HTML рендерится один раз.
+# Если в шаблоне появится {{ request ... }}, рендер нужно вернуть в обработчик
+_QUANTIZATION_HTML = _quantization_tpl.render()
 
 @router.get("/quantization-dashboard", response_class=HTMLResponse)
 async def quantization_dashboard(request: Request):
     """
     Главная страница дашборда управления квантованием
     """
-    return templates.TemplateResponse(
-        "quantization_dashboard.html",
-        {"request": request}
-    )
\ No newline at end of file
+    return HTMLResponse(content=_QUANTIZATION_HTML)
\ No newline at end of file
@@ -1,43 +1,68 @@
 # src/main.py
 import sys
 import os
+import asyncio
 sys.stdout.reconfigure(encoding='utf-8')
 
 import path_fix
+from path_fix import PROJECT_ROOT
 
-from pathlib import Path
-from fastapi import FastAPI
+import orjson
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import uvicorn
 from loguru import logger
+from prometheus_fastapi_instrumentator import Instrumentator
 
 # Только необходимые сервисы
 from services.model_manager import model_manager
 from services.model_discovery import model_discovery
+from services.embedding_batcher import embedding_batcher
+from services.llm_batcher import llm_batcher
+from services.quantization_service import quantization_service
 
 # Эндпоинты
 from api.routes.embeddings import router as embeddings_router
 from api.routes.chat import router as chat_router
 from api.routes.models import router as models_router
+from api.routes.batch import router as batch_router
+from api.routes.quantization import start_request_stats, stop_request_stats
 
 # Настройка путей
-BASE_DIR = Path(__file__).parent.parent
+BASE_DIR = PROJECT_ROOT
 MODELS_CACHE = BASE_DIR / "storage" / "models"
 LOGS_DIR = BASE_DIR / "storage" / "logs"
+PRELOAD_SHUTDOWN_TIMEOUT = 60  # секунд
+WARM_SHUTDOWN_TIMEOUT = 10     # секунд
 
 # Создаем папки если их нет
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
 MODELS_CACHE.mkdir(parents=True, exist_ok=True)
 
-# Настройка логгера
+# Настройка логгера: enqueue=True - запись на диск в фоновом потоке, а не в обработчике запроса
 logger.remove()
 logger.add(
     LOGS_DIR / "server.log",
     rotation="10 MB",
     retention=5,
+    compression="gz",
     format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
-    level="INFO"
+    level="INFO",
+    enqueue=True,
+    serialize=False
 )
+# В консоль (stderr службы) - только предупреждения и ошибки
+logger.add(sys.stderr, level="WARNING", enqueue=True)
+
+def _log_preload_result(task: asyncio.Task):
+    """Итог фоновой предзагрузки моделей"""
+    if task.cancelled():
+        logger.warning("⚠️ Предзагрузка отменена")
+    elif task.exception() is not None:
+        logger.error(f"❌ Ошибка предзагрузки: {task.exception()}")
+    else:
+        logger.info("✅ Предзагрузка завершена")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -53,55 +78,99 @@ async def lifespan(app: FastAPI):
     discovery_result = model_discovery.scan_models_cache()
     logger.info(f"📊 Найдено моделей в кеше: {discovery_result.get('total_models', 0)}")
     
-    # 🔴 ПРЕДЗАГРУЗКА ОСНОВНЫХ МОДЕЛЕЙ через model_manager
-    logger.info("🔄 Предзагрузка основных моделей...")
-    model_manager.preload_essential_models()
+    # 🔴 ПРЕДЗАГРУЗКА ОСНОВНЫХ МОДЕЛЕЙ через model_manager - в фоне:
+    # сервер сразу отвечает на /health, ранние запросы грузят модель лениво
+    logger.info("🔄 Предзагрузка основных моделей в фоне...")
+    app.state.preload_task = asyncio.create_task(model_manager.preload_essential_models())
+    app.state.preload_task.add_done_callback(_log_preload_result)
+    
+    # Рекомендации по квантованию для популярных моделей - в фоне, дашборд открывается уже прогретым
+    app.state.warm_task = asyncio.create_task(asyncio.to_thread(quantization_service.warm_suggestions_cache))
+    
+    # Фоновые воркеры динамического батчинга
+    embedding_batcher.start()
+    llm_batcher.start()
+    # Сводка запросов квантования раз в STATS_FLUSH_INTERVAL
+    start_request_stats()
     
     yield
     
     # Shutdown
     logger.info("🛑 Tamivla AI Server останавливается...")
-    for model_name in list(model_manager.loaded_models.keys()):
-        model_manager.unload_model(model_name)
+    await embedding_batcher.stop()
+    await llm_batcher.stop()
+    await stop_request_stats()
+    # Поток загрузки не прервать - даем ему закончить, чтобы выгрузка не гонялась с ним
+    if not app.state.preload_task.done():
+        logger.info("⏳ Ожидание завершения предзагрузки...")
+        await asyncio.wait([app.state.preload_task], timeout=PRELOAD_SHUTDOWN_TIMEOUT)
+    # Модели выгружаются параллельно: время остановки - максимум, а не сумма по моделям.
+    # Блокировки в model_manager по моделям, поэтому друг друга не ждут
+    await asyncio.gather(*(
+        asyncio.to_thread(model_manager.unload_model, model_name)
+        for model_name in list(model_manager.loaded_models.keys())
+    ))
+    # Прогрев рекомендаций опрашивает NVML в потоке - ждем его до nvmlShutdown
+    if not app.state.warm_task.done():
+        logger.info("⏳ Ожидание завершения прогрева рекомендаций...")
+        await asyncio.wait([app.state.warm_task], timeout=WARM_SHUTDOWN_TIMEOUT)
+    if app.state.warm_task.done():
+        quantization_service.shutdown()
+    else:
+        # Поток еще ходит в NVML - не закрываем его под ним, процесс все равно завершается
+        logger.warning("⚠️ Прогрев рекомендаций не завершился, NVML не закрыт")
+    # Дописываем очередь логов до выхода
+    await logger.complete()
 
 # Создаем приложение FastAPI
 app = FastAPI(
     title="Tamivla AI Server",
     description="OpenAI-совместимый API сервер для AI моделей",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Метрики Prometheus: латентность по маршрутам + метрики батчеров, отдаются на /metrics
+Instrumentator().instrument(app).expose(app, include_in_schema=False)
+
 # OpenAI-совместимые роутеры
 app.include_router(embeddings_router, prefix="/v1")
 app.include_router(chat_router, prefix="/v1/chat")
 app.include_router(models_router, prefix="/v1")
-
-# КАСТОМНЫЕ эндпоинты для управления моделями (БЕЗ префикса /v1)
-app.include_router(models_router)
+app.include_router(batch_router, prefix="/v1")
+
+# Статический каталог эндпоинтов: сериализуется один раз при импорте
+_ROOT_BYTES = orjson.dumps({
+    "message": "Tamivla AI Server работает!",
+    "version": "1.0.0",
+    "openai_endpoints": {
+        "embeddings": "/v1/embeddings",
+        "chat": "/v1/chat/completions", 
+        "models": "/v1/models",
+        "batch": "/v1/batch",
+        "docs": "/docs"
+    },
+    "custom_endpoints": {
+        "load_model": "/v1/models/load",
+        "unload_model": "/v1/models/unload", 
+        "loaded_models": "/v1/models/loaded",
+        "metrics": "/metrics"
+    }
+})
+_HEALTH_BYTES = orjson.dumps({"status": "healthy", "service": "Tamivla AI Server"})
+# Каталог эндпоинтов меняется только с релизом - браузеры и прокси могут его кешировать
+_ROOT_HEADERS = {"Cache-Control": "public, max-age=3600"}
 
 # Базовые эндпоинты
 @app.get("/")
 async def root():
-    return {
-        "message": "Tamivla AI Server работает!",
-        "version": "1.0.0",
-        "openai_endpoints": {
-            "embeddings": "/v1/embeddings",
-            "chat": "/v1/chat/completions", 
-            "models": "/v1/models",
-            "docs": "/docs"
-        },
-        "custom_endpoints": {
-            "load_model": "/models/load",
-            "unload_model": "/models/unload", 
-            "loaded_models": "/models/loaded"
-        }
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json", headers=_ROOT_HEADERS)
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "Tamivla AI Server"}
+    # Без Cache-Control: пробы здоровья должны доходить до сервера
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 def start_server():
     try:
@@ -116,17 +185,5 @@ def start_server():
         logger.error(f"Ошибка запуска сервера: {e}")
         sys.exit(1)
 
-# Временный эндпоинт для диагностики
-@app.get("/debug/routes")
-async def debug_routes():
-    routes = []
-    for route in app.routes:
-        routes.append({
-            "path": getattr(route, "path", None),
-            "name": getattr(route, "name", None),
-            "methods": getattr(route, "methods", None)
-        })
-    return {"routes": routes}
-
 if __name__ == "__main__":
     start_server()
\ No newline at end of file
@@ -6,24 +6,28 @@ import sys
 import os
 from pathlib import Path
 
+# Корень проекта - вычисляется один раз, остальные модули импортируют его отсюда
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
 def add_project_to_path():
     """Добавляет корневую папку проекта в Python path"""
-    project_root = Path(__file__).parent.parent
-    if str(project_root) not in sys.path:
-        sys.path.insert(0, str(project_root))
-        print(f"✅ Добавлен путь в Python path: {project_root}")
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+        print(f"✅ Добавлен путь в Python path: {PROJECT_ROOT}")
 
 def add_library_path():
     """Добавляет путь к библиотекам llama.cpp из LM Studio в PATH"""
-    project_root = Path(__file__).parent.parent
-    lib_path = project_root / "lib"
+    lib_path = PROJECT_ROOT / "lib"
     cuda_path = lib_path / "cuda"
     
     if lib_path.exists():
-        # Добавляем в системный PATH
-        path_str = str(lib_path) + ";" + str(cuda_path)
-        if path_str not in os.environ["PATH"]:
-            os.environ["PATH"] = path_str + ";" + os.environ["PATH"]
+        # Добавляем в системный PATH: сравниваем целые элементы, а не подстроку,
+        # разделитель - os.pathsep (";" в Windows, ":" в Linux)
+        entries = os.environ.get("PATH", "").split(os.pathsep)
+        present = set(entries)
+        missing = [path for path in (str(lib_path), str(cuda_path)) if path not in present]
+        if missing:
+            os.environ["PATH"] = os.pathsep.join(missing + entries)
             print(f"✅ Добавлены пути к библиотекам в PATH: {lib_path}")
         else:
             print(f"✅ Пути к библиотекам уже в PATH: {lib_path}")
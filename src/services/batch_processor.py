@@ -1,159 +1,192 @@
 # src/services/batch_processor.py
-from typing import List, Tuple
+from typing import Any, List, Optional, Tuple
+import numpy as np
 import torch
 import time
 from loguru import logger
 
+MAX_VOLUME_TTL = 2.0  # секунд: свободная память GPU между запросами почти не меняется, при OOM кеш сбрасывается
+DEDUPE_MIN_TEXTS = 8  # На маленьких запросах дедупликация дороже возможной экономии
+ACTIVATION_FACTOR = 12  # Активаций на токен в единицах hidden_size, с запасом на attention
+DEFAULT_MEMORY_PER_TOKEN = 1024 * 2 * ACTIVATION_FACTOR  # байт/токен, пока не загружена ни одна эмбеддинг-модель
+CHARS_PER_TOKEN = 4  # Эвристика BPE без токенизатора: ~4 символа на токен
+
+def approx_token_count(texts: List[str]) -> int:
+    """Токены для usage без токенизатора: символы / CHARS_PER_TOKEN, как в OpenAI-оценках"""
+    return int(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)).sum()) // CHARS_PER_TOKEN
+
 class VolumeBatchProcessor:
     """
     Volume-based батчер для эмбеддингов
     Формирует батчи based на объеме памяти, а не количестве текстов
+    Единица объема - токен: точный (если передан токенизатор модели),
+    иначе оценка len(text) // CHARS_PER_TOKEN
     """
     
     def __init__(self):
-        self.memory_per_char = 0.3  # Временное значение
-        self.is_calibrated = False
-        logger.info("🔧 Batch processor инициализирован, калибровка отложена")
+        # Байт VRAM на токен батча; None - пересчитать по загруженным моделям
+        self._memory_per_token: Optional[float] = None
+        # (время расчета, max_volume) - без CUDA-запросов на каждое формирование батчей
+        self._max_volume_cache: Tuple[float, int] = (0.0, 0)
+        self._cuda_available = torch.cuda.is_available()
+        logger.info("🔧 Batch processor инициализирован")
     
-    def _calibrate_memory_usage(self) -> float:
+    @staticmethod
+    def _estimate_memory_per_token() -> float:
         """
-        АВТОКАЛИБРОВКА: точное определение потребления памяти на символ
-        Вызывается при ПЕРВОМ использовании батчера
+        Оценка памяти на токен по форме модели, без тестового прогона:
+        hidden_size * байт на элемент * ACTIVATION_FACTOR (активации слоя + буферы attention)
+        Берется самая "широкая" из загруженных эмбеддинг-моделей
         """
-        try:
-            from services.model_manager import model_manager
-            
-            # Проверяем что модель загружена
-            model_name = "models--intfloat--multilingual-e5-large-instruct"
-            if model_name not in model_manager.loaded_models:
-                logger.warning("❌ Модель не загружена для калибровки, используем константу")
-                return 0.3  # Fallback
-            
-            model = model_manager.loaded_models[model_name]['model']
-            
-            # Тестовые тексты разной длины
-            test_texts = [
-                "A" * 100,    # Короткий текст
-                "A" * 500,    # Средний текст  
-                "A" * 1000,   # Длинный текст
-                "A" * 2000    # Очень длинный текст
-            ]
-            
-            # Замеряем память ДО обработки
-            torch.cuda.empty_cache()
-            initial_memory = torch.cuda.memory_allocated()
-            
-            # Обрабатываем тестовые тексты
-            start_time = time.time()
-            embeddings = model.encode(test_texts)
-            processing_time = time.time() - start_time
-            
-            # Замеряем память ПОСЛЕ обработки
-            final_memory = torch.cuda.memory_allocated()
-            memory_used = final_memory - initial_memory
-            
-            # Вычисляем общее количество символов
-            total_chars = sum(len(text) for text in test_texts)
-            
-            # Вычисляем память на символ
-            memory_per_char = memory_used / total_chars if total_chars > 0 else 0.3
-            
-            logger.info(f"🎯 Калибровка: {len(test_texts)} текстов, {total_chars} символов")
-            logger.info(f"🎯 Память: {memory_used/1024**2:.2f} MB, Время: {processing_time:.3f}s")
-            logger.info(f"🎯 Результат: {memory_per_char:.4f} байт/символ")
-            
-            # Очищаем память
-            del embeddings
-            torch.cuda.empty_cache()
-            
-            return max(0.1, min(1.0, memory_per_char))  # Ограничиваем разумные пределы
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка калибровки: {e}, используем константу 0.3")
-            return 0.3  # Fallback значение
+        from services.model_manager import model_manager
+        
+        hidden_sizes = [
+            entry.model.get_sentence_embedding_dimension() or 0
+            for entry in list(model_manager.loaded_models.values())
+            if entry.type == 'embedding'
+        ]
+        hidden_size = max(hidden_sizes, default=0)
+        if not hidden_size:
+            return DEFAULT_MEMORY_PER_TOKEN
+        
+        bytes_per_elem = torch.finfo(model_manager.active_dtype).bits // 8
+        memory_per_token = float(hidden_size * bytes_per_elem * ACTIVATION_FACTOR)
+        logger.info(f"🎯 Память на токен: {memory_per_token:.0f} байт (hidden={hidden_size}, {bytes_per_elem} байт/элемент)")
+        return memory_per_token
     
-    def _ensure_calibrated(self):
-        """Убеждаемся что калибровка выполнена"""
-        if not self.is_calibrated:
-            self.memory_per_char = self._calibrate_memory_usage()
-            self.is_calibrated = True
-            logger.info(f"🔧 Auto-calibrated memory per char: {self.memory_per_char:.4f} bytes")
+    @property
+    def memory_per_token(self) -> float:
+        if self._memory_per_token is None:
+            self._memory_per_token = self._estimate_memory_per_token()
+        return self._memory_per_token
     
-    def estimate_text_volume(self, text: str) -> int:
+    def estimate_text_volume(self, text: str, tokenizer: Optional[Any] = None) -> int:
         """
         Быстрая оценка объема памяти для текста
-        Возвращает условные единицы объема
+        Возвращает объем в токенах: точный или, без токенизатора, оценку по символам
+        """
+        if tokenizer is None:
+            return max(1, len(text) // CHARS_PER_TOKEN)
+        return max(1, tokenizer(text, add_special_tokens=False, truncation=True, return_length=True)["length"][0])
+    
+    def text_volumes(self, texts: List[str], tokenizer: Optional[Any] = None) -> np.ndarray:
+        """
+        Объемы всех текстов одним вызовом
+        Быстрый токенизатор кодирует весь список за один проход в Rust;
+        truncation - модель все равно обрежет текст до max_seq_length
         """
-        return max(1, len(text))
+        if tokenizer is None:
+            lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+            return np.maximum(lengths // CHARS_PER_TOKEN, 1)
+        lengths = tokenizer(texts, add_special_tokens=False, truncation=True, return_length=True)["length"]
+        return np.maximum(np.asarray(lengths, dtype=np.int64), 1)
+    
+    def invalidate_max_volume(self):
+        """Сброс кеша max_volume (модель загружена/выгружена или OOM - память изменилась)"""
+        self._max_volume_cache = (0.0, 0)
+        # Набор моделей мог измениться - оценка на токен пересчитывается при следующем запросе
+        self._memory_per_token = None
     
     def calculate_max_volume(self) -> int:
         """
         Вычисляет максимальный объем батча based на свободной памяти GPU
+        Результат кешируется на MAX_VOLUME_TTL секунд
         """
-        # 🔴 ВЫПОЛНЯЕМ КАЛИБРОВКУ ПРИ ПЕРВОМ ИСПОЛЬЗОВАНИИ
-        self._ensure_calibrated()
-        
-        if not torch.cuda.is_available():
+        if not self._cuda_available:
             return 10000  # Fallback для CPU
-            
-        # Получаем информацию о памяти
-        allocated = torch.cuda.memory_allocated()
-        total = torch.cuda.get_device_properties(0).total_memory
-        free_memory = total - allocated
+        
+        now = time.monotonic()
+        cached_at, cached_volume = self._max_volume_cache
+        if cached_volume and now - cached_at < MAX_VOLUME_TTL:
+            return cached_volume
+            
+        # Свободная память со стороны драйвера (cuMemGetInfo): учитывает другие процессы,
+        # фрагментацию и workspace cuDNN, которых не видит memory_allocated()
+        free_memory, _ = torch.cuda.mem_get_info(0)
+        # Блоки кеширующего аллокатора PyTorch свободны для наших тензоров, хоть драйвер их и не видит
+        free_memory += torch.cuda.memory_reserved(0) - torch.cuda.memory_allocated(0)
         
         # Используем 70% свободной памяти для безопасности
         safe_memory = int(free_memory * 0.7)
         
         # Конвертируем байты в условные единицы объема
-        max_volume = int(safe_memory / self.memory_per_char)
+        max_volume = int(safe_memory / self.memory_per_token)
         
-        logger.debug(f"🎯 Free: {free_memory/1024**2:.0f}MB -> Max volume: {max_volume}")
+        logger.debug("🎯 Free: {:.0f}MB -> Max volume: {}", free_memory / 1024**2, max_volume)
         
-        return max(1000, max_volume)  # Минимум 1000 единиц
+        max_volume = max(1000, max_volume)  # Минимум 1000 единиц
+        self._max_volume_cache = (now, max_volume)
+        return max_volume
     
-    def form_batches(self, texts: List[str]) -> List[List[str]]:
+    def form_batches(self, texts: List[str], tokenizer: Optional[Any] = None,
+                     volumes: Optional[np.ndarray] = None) -> List[List[str]]:
         """
         Формирует батчи based на объеме памяти
+        volumes - уже посчитанные объемы texts, чтобы не токенизировать повторно
         """
         if not texts:
             return []
             
         max_volume = self.calculate_max_volume()
-        batches = []
-        current_batch = []
-        current_volume = 0
         
-        for text in texts:
-            text_volume = self.estimate_text_volume(text)
-            
+        # Объемы и накопленная сумма считаются в NumPy один раз,
+        # граница каждого батча - один searchsorted вместо цикла по текстам
+        if volumes is None:
+            volumes = self.text_volumes(texts, tokenizer)
+        cumulative = np.cumsum(volumes)
+        
+        batches = []
+        start = 0
+        total = len(texts)
+        while start < total:
             # Если текст один слишком большой - обрабатываем отдельно
-            if text_volume > max_volume:
-                logger.warning(f"📏 Текст слишком большой: {text_volume} > {max_volume}")
-                if current_batch:
-                    batches.append(current_batch)
-                    current_batch = []
-                    current_volume = 0
-                batches.append([text])
+            if volumes[start] > max_volume:
+                logger.warning(f"📏 Текст слишком большой: {volumes[start]} > {max_volume}")
+                batches.append(texts[start:start + 1])
+                start += 1
                 continue
             
-            # Проверяем влезает ли текст в текущий батч
-            if current_volume + text_volume > max_volume and current_batch:
-                # Батч заполнен - сохраняем и начинаем новый
-                batches.append(current_batch)
-                current_batch = [text]
-                current_volume = text_volume
-            else:
-                # Добавляем в текущий батч
-                current_batch.append(text)
-                current_volume += text_volume
-        
-        # Добавляем последний батч если он не пустой
-        if current_batch:
-            batches.append(current_batch)
+            # Первый текст, с которым объем батча превысил бы max_volume
+            target = (cumulative[start - 1] if start else 0) + max_volume
+            end = int(np.searchsorted(cumulative, target, side='right'))
+            batches.append(texts[start:end])
+            start = end
             
-        logger.info(f"📦 Сформировано батчей: {len(batches)} для {len(texts)} текстов")
+        logger.debug("📦 Сформировано батчей: {} для {} текстов", len(batches), len(texts))
         
         return batches
 
+    @staticmethod
+    def dedupe(texts: List[str]) -> Tuple[List[str], List[int]]:
+        """
+        Убирает повторы текстов: (unique, inverse), где texts[i] == unique[inverse[i]]
+        Заголовки и шаблонные куски в RAG-корпусах кодируются один раз
+        """
+        seen = {}
+        unique = []
+        inverse = []
+        for text in texts:
+            index = seen.get(text)
+            if index is None:
+                index = seen[text] = len(unique)
+                unique.append(text)
+            inverse.append(index)
+        return unique, inverse
+    
+    def form_sorted_batches(self, texts: List[str], tokenizer: Optional[Any] = None) -> Tuple[List[List[str]], List[int]]:
+        """
+        Батчи из текстов, отсортированных по объему
+        В батч попадают тексты близкой длины, и модель почти не паддит короткие до длинных
+        Возвращает (batches, order): k-й текст в склейке батчей - это texts[order[k]],
+        поэтому результаты возвращаются на место как out[order[k]] = computed[k]
+        """
+        if not texts:
+            return [], []
+        
+        volumes = self.text_volumes(texts, tokenizer)
+        order = np.argsort(volumes, kind='stable')
+        sorted_texts = [texts[i] for i in order]
+        return self.form_batches(sorted_texts, volumes=volumes[order]), order.tolist()
+
 # Глобальный экземпляр
 batch_processor = VolumeBatchProcessor()
\ No newline at end of file
@@ -0,0 +1,214 @@
+# src/services/batching.py
+"""
+Общая основа для очередей динамического батчинга
+Запросы копятся в asyncio.Queue, фоновый воркер забирает их пачками
+"""
+
+import math
+import time
+import asyncio
+from collections import deque
+from typing import List, Any, Optional, Tuple
+from loguru import logger
+
+from services.metrics import DYNAMIC_MAX_BATCH
+
+QUEUE_LIMIT = 256        # Максимум запросов, ожидающих в очереди
+LATENCY_WINDOW = 100     # Сколько последних батчей учитываем в статистике
+MAX_BATCH_LIMIT = 64     # Потолок размера батча для адаптивного контроллера
+P95_EWMA_ALPHA = 0.2     # Сглаживание P95 для контроллера
+
+# (полезная нагрузка запроса, future с результатом)
+QueueItem = Tuple[Any, asyncio.Future]
+
+class BatcherOverloaded(Exception):
+    """Очередь переполнена: запрос отклонен сразу, а не после долгого ожидания"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+class LatencyTracker:
+    """Скользящее окно длительностей батчей: среднее и P95"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    @property
+    def average(self) -> float:
+        return sum(self._samples) / len(self._samples) if self._samples else 0.0
+
+    @property
+    def p95(self) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def expected_wait(self, queued: int, batch_size: int) -> float:
+        """Оценка ожидания по закону Литтла: очередь / пропускная способность"""
+        return queued * self.average / max(1, batch_size)
+
+class QueueBatcher:
+    """
+    Очередь + фоновый воркер: батч закрывается по размеру или по таймауту
+    При заданном target_latency размер батча подстраивается по сглаженному P95:
+    хвост выше цели - батч уменьшается, ниже половины цели - растет
+    """
+
+    name = "batcher"
+    # Длительность батча замеряет воркер; False - наследник замеряет сам
+    timed_by_worker = True
+    # Метрики Prometheus, задаются в наследниках
+    batch_size_metric = None
+    latency_metric = None
+    queue_depth_metric = None
+
+    def __init__(self, max_batch_size: int, max_wait_ms: int, max_wait_budget: float,
+                 queue_limit: int = QUEUE_LIMIT, target_latency: Optional[float] = None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_wait_budget = max_wait_budget
+        self.queue_limit = queue_limit
+        self.target_latency = target_latency
+        self.latency = LatencyTracker()
+        self._p95_ewma = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Батч, который воркер собирает или обрабатывает: при остановке его запросы
+        # уже вынуты из очереди, но ответа еще не получили
+        self._current_batch: List[QueueItem] = []
+
+        # Глубина очереди читается в момент опроса /metrics, без затрат на горячем пути
+        if self.queue_depth_metric is not None:
+            self.queue_depth_metric.set_function(lambda: self.queue_depth)
+        DYNAMIC_MAX_BATCH.labels(batcher=self.name).set(self.max_batch_size)
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None
+
+    def start(self):
+        """Запуск фонового воркера (вызывается из lifespan)"""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_limit)
+        self._worker = asyncio.create_task(self._batch_worker())
+        logger.info(f"📦 {self.name} запущен: batch={self.max_batch_size}, wait={self.max_wait * 1000:.0f}ms")
+
+    async def stop(self):
+        """Остановка воркера, ожидающие запросы получают ошибку"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        pending = self._current_batch
+        self._current_batch = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} остановлен"))
+        logger.info(f"🛑 {self.name} остановлен")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _record_latency(self, seconds: float):
+        """Учет длительности батча и подстройка max_batch_size под target_latency"""
+        self.latency.record(seconds)
+        if self.latency_metric is not None:
+            self.latency_metric.observe(seconds)
+
+        if self.target_latency is None:
+            return
+        self._p95_ewma = P95_EWMA_ALPHA * self.latency.p95 + (1 - P95_EWMA_ALPHA) * self._p95_ewma
+
+        if self._p95_ewma > self.target_latency:
+            new_size = max(1, self.max_batch_size - 1)
+        elif self._p95_ewma < 0.5 * self.target_latency:
+            new_size = min(MAX_BATCH_LIMIT, self.max_batch_size + 1)
+        else:
+            return
+
+        if new_size != self.max_batch_size:
+            logger.debug(f"📐 {self.name}: batch {self.max_batch_size} -> {new_size}, P95 ~{self._p95_ewma:.3f}s")
+            self.max_batch_size = new_size
+            DYNAMIC_MAX_BATCH.labels(batcher=self.name).set(new_size)
+
+    def _expected_wait(self) -> float:
+        """Оценка ожидания нового запроса: очередь, деленная на пропускную способность батча"""
+        return self.latency.expected_wait(self._queue.qsize(), self.max_batch_size)
+
+    async def _enqueue(self, payload: Any) -> Any:
+        """
+        Ставит запрос в очередь и ждет, пока воркер выставит результат
+        Если очередь полна или ожидание превысит бюджет - BatcherOverloaded
+        """
+        expected_wait = self._expected_wait()
+        if expected_wait > self.max_wait_budget:
+            raise BatcherOverloaded(
+                f"{self.name} перегружен: ожидание ~{expected_wait:.1f}s", retry_after=expected_wait
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((payload, future))
+        except asyncio.QueueFull:
+            raise BatcherOverloaded(
+                f"{self.name} перегружен: в очереди {self.queue_limit} запросов",
+                retry_after=max(self.latency.average, 1.0)
+            )
+        return await future
+
+    async def _collect_batch(self) -> List[QueueItem]:
+        """Ждет первый запрос, затем добирает до max_batch_size или до истечения max_wait"""
+        loop = asyncio.get_running_loop()
+        batch = self._current_batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _batch_worker(self):
+        """Фоновый цикл: собрать батч -> обработать -> раздать результаты"""
+        while True:
+            batch = await self._collect_batch()
+            if self.batch_size_metric is not None:
+                self.batch_size_metric.observe(len(batch))
+            started = time.perf_counter()
+            try:
+                await self._process_batch(batch)
+                if self.timed_by_worker:
+                    self._record_latency(time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"❌ {self.name}: ошибка обработки батча: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._current_batch = []
+
+    async def _process_batch(self, batch: List[QueueItem]):
+        """Обработка собранного батча - реализуется в наследниках"""
+        raise NotImplementedError
@@ -0,0 +1,145 @@
+# src/services/embedding_batcher.py
+"""
+Динамический батчинг запросов эмбеддингов
+Параллельные HTTP-запросы копятся в очереди и уходят в модель одним вызовом
+"""
+
+import os
+import bisect
+import asyncio
+from typing import List, Dict, Any, Optional
+import numpy as np
+from loguru import logger
+
+from services.batching import QueueBatcher, QueueItem
+from services.embedding_service import embedding_service
+from services.batch_processor import CHARS_PER_TOKEN
+from services.model_manager import model_manager
+from services.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_LATENCY, EMBEDDING_QUEUE_DEPTH
+
+MAX_BATCH = 32      # Максимум запросов в одном батче
+MAX_WAIT_MS = 20    # Сколько ждем добора батча после первого запроса
+MAX_WAIT_BUDGET = 2.0   # Допустимое ожидание в очереди, секунд; дольше - 429
+# Целевой P95 батча, секунд: по нему подстраивается размер батча
+EMBEDDING_TARGET_LATENCY = float(os.environ.get('EMBEDDING_TARGET_LATENCY', 0.5))
+
+# Границы корзин по длине в токенах: короткие тексты не паддятся до длинных
+LENGTH_BUCKETS = (32, 64, 128, 256)
+
+class EmbeddingBatcher(QueueBatcher):
+    """Очередь запросов эмбеддингов: один forward на всех"""
+
+    name = "Embedding batcher"
+    batch_size_metric = EMBEDDING_BATCH_SIZE
+    latency_metric = EMBEDDING_LATENCY
+    queue_depth_metric = EMBEDDING_QUEUE_DEPTH
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: int = MAX_WAIT_MS,
+                 max_wait_budget: float = MAX_WAIT_BUDGET,
+                 target_latency: float = EMBEDDING_TARGET_LATENCY):
+        super().__init__(max_batch, max_wait_ms, max_wait_budget, target_latency=target_latency)
+
+    async def submit(self, texts: List[str], model_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Ставит тексты в очередь и ждет результат
+        Формат ответа совпадает с embedding_service.get_embeddings
+        """
+        model_to_use = model_name or embedding_service.default_model
+
+        # Воркер не запущен или батчить нечего - идем напрямую в сервис
+        if not self.is_running or not texts:
+            return await embedding_service.get_embeddings(texts, model_to_use)
+
+        return await self._enqueue((texts, model_to_use))
+
+    @staticmethod
+    async def _length_buckets(texts: List[str], model_name: str) -> List[List[int]]:
+        """
+        Раскладывает индексы текстов по корзинам длины в токенах
+        Модель паддит батч до самого длинного текста, поэтому 10-токенный запрос
+        рядом с 256-токенным документом почти целиком считает PAD
+        """
+        model = model_manager.get_model(model_name)
+        tokenizer = getattr(model, "tokenizer", None)
+        if tokenizer is None:
+            # Модель еще не загружена - токенизировать нечем, одна корзина
+            return [list(range(len(texts)))]
+
+        # Быстрый (Rust) токенизатор отпускает GIL - считаем в потоке, event loop свободен
+        encoded = await asyncio.to_thread(tokenizer, texts, add_special_tokens=True, truncation=True)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        buckets: List[List[int]] = [[] for _ in range(len(LENGTH_BUCKETS) + 1)]
+        for i, length in enumerate(lengths):
+            buckets[bisect.bisect_left(LENGTH_BUCKETS, length)].append(i)
+        return [bucket for bucket in buckets if bucket]
+
+    async def _encode_bucketed(self, texts: List[str], model_name: str) -> Dict[str, Any]:
+        """Один вызов модели на корзину, эмбеддинги возвращаются в исходном порядке"""
+        buckets = await self._length_buckets(texts, model_name)
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        batches_used = 0
+        result: Dict[str, Any] = {}
+
+        for bucket in buckets:
+            result = await embedding_service.get_embeddings([texts[i] for i in bucket], model_name)
+            if "error" in result:
+                return result
+            for i, item in zip(bucket, result["data"]):
+                embeddings[i] = item["embedding"]
+            batches_used += result.get("batches_used", 0)
+
+        logger.opt(lazy=True).debug("📦 Корзины длины: {}", lambda: [len(bucket) for bucket in buckets])
+        return {
+            "data": [{"embedding": embedding} for embedding in embeddings],
+            "model": result.get("model", model_name),
+            "batches_used": batches_used
+        }
+
+    async def _process_batch(self, batch: List[QueueItem]):
+        """Склеивает тексты запросов одной модели и режет ответ обратно по запросам"""
+        by_model: Dict[str, List[QueueItem]] = {}
+        for item in batch:
+            by_model.setdefault(item[0][1], []).append(item)
+
+        for model_name, items in by_model.items():
+            all_texts = [text for (texts, _), _ in items for text in texts]
+            logger.debug("📦 Батч эмбеддингов: {} запросов, {} текстов", len(items), len(all_texts))
+
+            result = await self._encode_bucketed(all_texts, model_name)
+
+            # Ошибка модели - одинаковая для всех запросов батча
+            if "error" in result:
+                for _, future in items:
+                    if not future.done():
+                        future.set_result(result)
+                continue
+
+            data = result["data"]
+            # Символы всех текстов батча одним проходом; usage запроса - разность префиксных сумм
+            chars = np.concatenate(([0], np.cumsum(np.fromiter(map(len, all_texts), dtype=np.int64, count=len(all_texts)))))
+            offset = 0
+            for (texts, _), future in items:
+                chunk = data[offset:offset + len(texts)]
+                total_tokens = int(chars[offset + len(texts)] - chars[offset]) // CHARS_PER_TOKEN
+                offset += len(texts)
+
+                # Клиент мог отключиться - future уже отменен
+                if future.done():
+                    continue
+
+                future.set_result({
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "embedding": item["embedding"], "index": i}
+                        for i, item in enumerate(chunk)
+                    ],
+                    "model": result["model"],
+                    "usage": {
+                        "prompt_tokens": total_tokens,
+                        "total_tokens": total_tokens
+                    },
+                    "batches_used": result.get("batches_used", 0)
+                })
+
+# Глобальный экземпляр
+embedding_batcher = EmbeddingBatcher()
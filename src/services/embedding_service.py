@@ -1,21 +1,112 @@
 # src/services/embedding_service.py
+import os
+import time
+import asyncio
 from typing import List, Dict, Any, Optional
 import numpy as np
+import torch
 from loguru import logger
 from sentence_transformers import SentenceTransformer
 
 from services.model_manager import model_manager
-from services.batch_processor import batch_processor
+from services.batch_processor import batch_processor, approx_token_count, DEDUPE_MIN_TEXTS
+
+ENCODE_BATCH_SIZE = 64  # Внутренний batch_size sentence-transformers для одного вызова encode
+
+# Быстрый (Rust) токенизатор параллелит батч по ядрам; encode идет в потоке, а не в event loop
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'true')
 
 class EmbeddingService:
     """Сервис для работы с текстовыми эмбеддингами"""
     
     def __init__(self):
         self.default_model = "intfloat/multilingual-e5-large-instruct"  # ← HF СТАНДАРТ
+    
+    @staticmethod
+    def _encode(model: SentenceTransformer, texts: List[str], normalize: bool) -> np.ndarray:
+        """Один вызов модели, результат - float32 массив (len(texts), dim)"""
+        # Тензор вместо numpy: bf16 не конвертируется в numpy, приводим к fp32 сами
+        with model_manager.inference_context():
+            embeddings = model.encode(
+                texts,
+                batch_size=ENCODE_BATCH_SIZE,
+                normalize_embeddings=normalize,
+                convert_to_tensor=True,
+                show_progress_bar=False
+            )
+            # Копия на CPU в том же потоке: одна синхронизация на весь запрос
+            return embeddings.float().cpu().numpy()
+    
+    def _encode_split(self, model: SentenceTransformer, texts: List[str], normalize: bool) -> np.ndarray:
+        """Кодирует батч, при нехватке памяти делит его пополам"""
+        try:
+            return self._encode(model, texts, normalize)
+        except torch.cuda.OutOfMemoryError:
+            if len(texts) == 1:
+                raise
+            batch_processor.invalidate_max_volume()
+            middle = len(texts) // 2
+            logger.warning(f"⚠️ OOM на батче из {len(texts)} текстов, делим пополам")
+            return np.concatenate([
+                self._encode_split(model, texts[:middle], normalize),
+                self._encode_split(model, texts[middle:], normalize)
+            ])
+    
+    def _encode_with_fallback(self, model: SentenceTransformer, texts: List[str], normalize: bool):
+        """
+        Эмбеддинги texts в исходном порядке и число использованных батчей
+        Сначала один encode на все тексты; при OOM - volume-based батчи по памяти GPU
+        """
+        try:
+            return self._encode(model, texts, normalize), 1
+        except torch.cuda.OutOfMemoryError:
+            # empty_cache не нужен: перед OOM аллокатор уже сам отпустил свободные блоки.
+            # Закешированный max_volume больше не соответствует свободной памяти
+            batch_processor.invalidate_max_volume()
+            logger.warning(f"⚠️ OOM при кодировании {len(texts)} текстов, переходим на volume-батчи")
+        
+        # 🔥 VOLUME-BASED БАТЧИНГ по текстам, отсортированным по числу токенов
+        batches, order = batch_processor.form_sorted_batches(texts, getattr(model, "tokenizer", None))
         
-    async def get_embeddings(self, texts: List[str], model_name: Optional[str] = None) -> Dict[str, Any]:
+        # Один выходной буфер на весь запрос: батч пишется сразу на исходные позиции текстов,
+        # без промежуточных списков и отдельной перестановки в конце
+        embeddings: Optional[np.ndarray] = None
+        offset = 0
+        for batch in batches:
+            batch_embeddings = self._encode_split(model, batch, normalize)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[order[offset:offset + len(batch)]] = batch_embeddings
+            offset += len(batch)
+        return embeddings, len(batches)
+        
+    @staticmethod
+    async def _get_model(model_name: str) -> Optional[SentenceTransformer]:
+        """Загруженная модель или None, если загрузить не удалось"""
+        # 🔴 ИСПРАВЛЕННАЯ ПРОВЕРКА: используем model_manager.is_model_loaded()
+        if not model_manager.is_model_loaded(model_name):
+            logger.info(f"Loading model: {model_name}")
+            success = await model_manager.load_model_async(model_name, "embedding")
+            if not success:
+                return None
+        return model_manager.get_model(model_name)
+    
+    async def encode_normalized(self, texts: List[str], model_name: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        L2-нормированные эмбеддинги массивом (len(texts), dim) для сравнения внутри сервера
+        Без OpenAI-обертки и списков Python: косинус - один matmul над результатом
+        None - модель недоступна
+        """
+        model = await self._get_model(model_name or self.default_model)
+        if model is None:
+            return None
+        embeddings, _ = await asyncio.to_thread(self._encode_with_fallback, model, texts, True)
+        return embeddings
+    
+    async def get_embeddings(self, texts: List[str], model_name: Optional[str] = None, normalize: bool = False) -> Dict[str, Any]:
         """
         Получение векторных представлений для списка текстов
+        normalize=True - L2-нормировка на стороне модели (косинус = скалярное произведение)
         """
         try:
             if not texts:
@@ -28,40 +119,44 @@ class EmbeddingService:
                 
             model_to_use = model_name or self.default_model
             
-            # 🔴 ИСПРАВЛЕННАЯ ПРОВЕРКА: используем model_manager.is_model_loaded()
-            if not model_manager.is_model_loaded(model_to_use):
-                logger.info(f"Loading model: {model_to_use}")
-                success = model_manager.load_model(model_to_use, "embedding")
-                if not success:
-                    return {
-                        "object": "list",
-                        "data": [],
-                        "model": model_to_use,
-                        "error": f"Failed to load model: {model_to_use}"
-                    }
-            
-            # Получаем модель
-            model = model_manager.get_model(model_to_use)
+            model = await self._get_model(model_to_use)
+            if model is None:
+                return {
+                    "object": "list",
+                    "data": [],
+                    "model": model_to_use,
+                    "error": f"Failed to load model: {model_to_use}"
+                }
             
-            # 🔥 ИСПОЛЬЗУЕМ VOLUME-BASED БАТЧИНГ
-            batches = batch_processor.form_batches(texts)
-            all_embeddings = []
+            # Повторяющиеся тексты кодируем один раз
+            if len(texts) >= DEDUPE_MIN_TEXTS:
+                unique_texts, inverse = batch_processor.dedupe(texts)
+            else:
+                unique_texts, inverse = texts, None
             
-            for batch in batches:
-                if batch:
-                    batch_embeddings = model.encode(batch).tolist()
-                    all_embeddings.extend(batch_embeddings)
+            # Один вызов encode на весь запрос: sentence-transformers сам сортирует
+            # тексты по длине и режет на батчи; volume-батчинг - только при нехватке памяти
+            # Токенизация и forward блокируют - в потоке, event loop принимает запросы дальше
+            started = time.perf_counter()
+            unique_embeddings, batches_used = await asyncio.to_thread(
+                self._encode_with_fallback, model, unique_texts, normalize
+            )
+            # Одна итоговая строка на запрос вместо логов по батчам
+            logger.debug("📦 Эмбеддинги: {} текстов, батчей {}, {:.3f}s",
+                         len(texts), batches_used, time.perf_counter() - started)
+            all_embeddings = unique_embeddings if inverse is None else unique_embeddings[inverse]
             
             # 🔴 OPENAI-СОВМЕСТИМЫЙ ФОРМАТ ОТВЕТА
+            # Строки float32-массива без .tolist(): ORJSONResponse сериализует numpy напрямую
             response_data = []
-            for i, embedding in enumerate(all_embeddings):
+            for i, embedding in enumerate(all_embeddings):  # строки - view, без копирования
                 response_data.append({
                     "object": "embedding",
                     "embedding": embedding,
                     "index": i
                 })
             
-            total_tokens = sum(len(text) for text in texts)
+            total_tokens = approx_token_count(texts)
             
             return {
                 "object": "list",
@@ -71,7 +166,7 @@ class EmbeddingService:
                     "prompt_tokens": total_tokens,
                     "total_tokens": total_tokens
                 },
-                "batches_used": len(batches)  # 🔥 НАШЕ КАСТОМНОЕ ПОЛЕ
+                "batches_used": batches_used  # 🔥 НАШЕ КАСТОМНОЕ ПОЛЕ
             }
             
         except Exception as e:
@@ -0,0 +1,121 @@
+# src/services/llm_backend_llamacpp.py
+"""
+LLM-бэкенд на llama.cpp (GGUF, например Q4_K_M)
+Включается через LLM_BACKEND=llamacpp, интерфейс совпадает с llm_service
+"""
+
+import os
+import asyncio
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, AsyncIterator
+from loguru import logger
+
+LLAMACPP_MODEL_PATH = os.environ.get('LLAMACPP_MODEL_PATH', '')
+LLAMACPP_N_CTX = int(os.environ.get('LLAMACPP_N_CTX', 4096))
+LLAMACPP_N_BATCH = int(os.environ.get('LLAMACPP_N_BATCH', 512))
+LLAMACPP_N_GPU_LAYERS = int(os.environ.get('LLAMACPP_N_GPU_LAYERS', -1))  # -1 - все слои на GPU
+
+_STREAM_END = object()
+
+class LlamaCppBackend:
+    """
+    Генерация через llama_cpp.Llama
+    Один экземпляр Llama не потокобезопасен: вызовы идут в потоке и по очереди
+    """
+
+    def __init__(self, model_path: str = LLAMACPP_MODEL_PATH):
+        self.model_path = model_path
+        self._llm = None
+        self._load_lock = threading.Lock()
+        self._generate_lock = asyncio.Lock()
+
+    @property
+    def model_id(self) -> str:
+        return Path(self.model_path).name
+
+    def _get_llm(self):
+        """Ленивая загрузка GGUF-модели (блокирующая, вызывается в потоке)"""
+        with self._load_lock:
+            if self._llm is None:
+                from llama_cpp import Llama
+                logger.info(f"🦙 Загрузка GGUF-модели: {self.model_path}")
+                self._llm = Llama(
+                    model_path=self.model_path,
+                    n_ctx=LLAMACPP_N_CTX,
+                    n_batch=LLAMACPP_N_BATCH,
+                    n_gpu_layers=LLAMACPP_N_GPU_LAYERS,
+                    verbose=False
+                )
+                logger.success(f"✅ GGUF-модель загружена: {self.model_id}")
+            return self._llm
+
+    @staticmethod
+    def _generation_params(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        params = {"max_tokens": kwargs.get("max_tokens", 500)}
+        if kwargs.get("temperature") is not None:
+            params["temperature"] = kwargs["temperature"]
+        return params
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model_name: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Чат-комплишн в OpenAI-формате"""
+        if not self.model_path:
+            return {"error": "LLAMACPP_MODEL_PATH is not set", "choices": []}
+
+        def run():
+            return self._get_llm().create_chat_completion(messages=messages, **self._generation_params(kwargs))
+
+        try:
+            async with self._generate_lock:
+                result = await asyncio.to_thread(run)
+            result["model"] = model_name or self.model_id
+            return result
+        except Exception as e:
+            logger.error(f"❌ llama.cpp: ошибка генерации: {e}")
+            return {"error": f"LLM error: {str(e)}", "choices": []}
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model_name: Optional[str] = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковая генерация: токены из потока llama.cpp передаются в event loop
+        Ошибка поднимается как RuntimeError, как и в llm_service
+        """
+        if not self.model_path:
+            raise RuntimeError("LLAMACPP_MODEL_PATH is not set")
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def run():
+            try:
+                for chunk in self._get_llm().create_chat_completion(
+                    messages=messages, stream=True, **self._generation_params(kwargs)
+                ):
+                    if stop.is_set():
+                        break
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        loop.call_soon_threadsafe(queue.put_nowait, content)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, RuntimeError(f"LLM error: {str(e)}"))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+        async with self._generate_lock:
+            worker = asyncio.create_task(asyncio.to_thread(run))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                # Клиент отключился - генерация прерывается на следующем токене;
+                # ждем поток, чтобы не запустить следующую генерацию параллельно
+                stop.set()
+                await worker
+
+# Глобальный экземпляр
+llamacpp_backend = LlamaCppBackend()
@@ -0,0 +1,112 @@
+# src/services/llm_batcher.py
+"""
+Очередь чат-запросов перед LLM-бэкендом
+llama.cpp генерирует по одному запросу за раз (один Llama на процесс, вызовы под блокировкой),
+общего forward для нескольких промптов нет - поэтому запросы не батчатся,
+а очередь дает только ограничение нагрузки и честный 429 при перегрузке
+"""
+
+import os
+import time
+import asyncio
+from typing import List, Dict, Any, Optional
+from loguru import logger
+
+from services.batching import QueueBatcher, QueueItem
+from services.llm_service import llm_service
+from services.metrics import CHAT_LATENCY, CHAT_QUEUE_DEPTH
+
+MAX_WAIT_BUDGET = 60.0   # Допустимое ожидание в очереди, секунд; дольше - 429
+# Сколько генераций одновременно передается бэкенду; llama.cpp все равно выполняет их по одной
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 1))
+
+class LLMBatcher(QueueBatcher):
+    """
+    Очередь чат-запросов: воркер забирает их по одному, без окна добора батча,
+    и одновременно генерируется не больше max_concurrency запросов
+    Каждый ответ отдается клиенту сразу по готовности
+    """
+
+    name = "LLM batcher"
+    # Воркер только раздает запросы, длительность генерации замеряет _run_request
+    timed_by_worker = False
+    latency_metric = CHAT_LATENCY
+    queue_depth_metric = CHAT_QUEUE_DEPTH
+
+    def __init__(self, max_wait_budget: float = MAX_WAIT_BUDGET, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        # Батч из одного запроса и без ожидания: склеивать запросы бэкенду нечем
+        super().__init__(1, 0, max_wait_budget)
+        self.max_concurrency = max(1, max_concurrency)
+        # Воркер ждет свободный слот: остальные запросы копятся в ограниченной очереди,
+        # где их видят QueueFull и оценка ожидания
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        # Генерирующаяся задача -> future ее запроса
+        self._inflight: Dict[asyncio.Task, asyncio.Future] = {}
+
+    async def stop(self):
+        """Остановка воркера и запросов, которые еще генерируются"""
+        for task in list(self._inflight):
+            task.cancel()
+        await super().stop()
+
+    async def submit(self, messages: List[Dict[str, str]], model_name: Optional[str] = None,
+                     temperature: Optional[float] = 0.7, max_tokens: int = 500) -> Dict[str, Any]:
+        """Ставит запрос в очередь и ждет ответ модели"""
+        if not self.is_running:
+            return await llm_service.chat_completion(
+                messages=messages,
+                model_name=model_name,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+
+        return await self._enqueue((messages, model_name, temperature, max_tokens))
+
+    def _expected_wait(self) -> float:
+        """
+        Оценка ожидания по закону Литтла с учетом уже идущих генераций:
+        (в очереди + ждет слот у воркера + генерируется) * среднее время / число слотов
+        """
+        backlog = self._queue.qsize() + len(self._current_batch) + len(self._inflight)
+        return self.latency.expected_wait(backlog, self.max_concurrency)
+
+    async def _process_batch(self, batch: List[QueueItem]):
+        """Запускает генерацию в фоне, как только освободится слот"""
+        for item in batch:
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run_request(item))
+            self._inflight[task] = item[1]
+            task.add_done_callback(self._request_done)
+
+    def _request_done(self, task: asyncio.Task):
+        future = self._inflight.pop(task)
+        self._slots.release()
+        # Задачу отменили при остановке до первого шага - finally в _run_request не выполнился
+        if not future.done():
+            future.set_exception(RuntimeError(f"{self.name} остановлен"))
+
+    async def _run_request(self, item: QueueItem):
+        """Один вызов chat_completion, результат - в future запроса"""
+        (messages, model_name, temperature, max_tokens), future = item
+        started = time.perf_counter()
+        try:
+            result = await llm_service.chat_completion(
+                messages,
+                model_name=model_name,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            self._record_latency(time.perf_counter() - started)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"❌ Ошибка генерации чата: {e}")
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            # Генерация отменена при остановке - никто не должен ждать вечно
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} остановлен"))
+
+# Глобальный экземпляр
+llm_batcher = LLMBatcher()
@@ -1,25 +1,55 @@
 # src/services/llm_service.py
 """
 Сервис языковых моделей для Tamivla AI Server
-Только эмбеддинги - LLM временно отключен
+По умолчанию LLM отключен; LLM_BACKEND=llamacpp включает генерацию через llama.cpp
 """
 
-from typing import List, Dict, Any, Optional
+import os
+from typing import List, Dict, Any, Optional, AsyncIterator
 from loguru import logger
 
+LLM_BACKEND = os.environ.get('LLM_BACKEND', '').lower()
+
 class LLMService:
-    """Сервис для работы с языковыми моделями - временно только заглушка"""
+    """Тонкая прослойка над бэкендом генерации; без бэкенда - заглушка"""
     
-    def __init__(self):
-        logger.info("🤖 LLM Service: временно отключен, работаем только с эмбеддингами")
+    def __init__(self, backend_name: str = LLM_BACKEND):
+        self.backend = None
+        if backend_name == "llamacpp":
+            from services.llm_backend_llamacpp import llamacpp_backend
+            self.backend = llamacpp_backend
+            logger.info(f"🤖 LLM Service: бэкенд llama.cpp ({llamacpp_backend.model_path or 'модель не задана'})")
+        else:
+            logger.info("🤖 LLM Service: временно отключен, работаем только с эмбеддингами")
         
     async def chat_completion(self, messages: List[Dict[str, str]], model_name: Optional[str] = None, **kwargs) -> Dict[str, Any]:
-        """Заглушка для чат-комплишн"""
+        """Чат-комплишн через бэкенд или заглушка"""
+        if self.backend is not None:
+            return await self.backend.chat_completion(messages, model_name=model_name, **kwargs)
         return {
             "error": "LLM service temporarily disabled - embeddings only",
             "choices": []
         }
     
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model_name: Optional[str] = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Потоковый чат-комплишн: отдает текст по мере генерации
+        Ошибка сервиса поднимается как RuntimeError до первого куска текста
+        """
+        if self.backend is not None:
+            async for token in self.backend.stream_chat_completion(messages, model_name=model_name, **kwargs):
+                yield token
+            return
+        
+        result = await self.chat_completion(messages, model_name=model_name, **kwargs)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        
+        for choice in result.get("choices", []):
+            content = choice.get("message", {}).get("content", "")
+            if content:
+                yield content
+    
     async def generate_text(self, prompt: str, model_name: Optional[str] = None, **kwargs) -> Dict[str, Any]:
         """Заглушка для генерации текста"""
         return {
@@ -0,0 +1,34 @@
+# src/services/metrics.py
+"""
+Метрики Prometheus для батчеров
+Латентность маршрутов снимает prometheus_fastapi_instrumentator в main.py
+"""
+
+from prometheus_client import Gauge, Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+# Эмбеддинги
+EMBEDDING_BATCH_SIZE = Histogram(
+    "embedding_batch_size", "Запросов в батче эмбеддингов", buckets=BATCH_SIZE_BUCKETS
+)
+EMBEDDING_LATENCY = Histogram(
+    "embedding_latency_seconds", "Длительность батча эмбеддингов", buckets=LATENCY_BUCKETS
+)
+EMBEDDING_QUEUE_DEPTH = Gauge(
+    "embedding_queue_depth", "Запросов эмбеддингов в очереди"
+)
+
+# Чат
+CHAT_LATENCY = Histogram(
+    "chat_latency_seconds", "Длительность генерации чат-ответа", buckets=LATENCY_BUCKETS
+)
+CHAT_QUEUE_DEPTH = Gauge(
+    "chat_queue_depth", "Чат-запросов в очереди"
+)
+
+# Текущий размер батча, который подбирает контроллер по P95
+DYNAMIC_MAX_BATCH = Gauge(
+    "dynamic_max_batch", "Текущий максимальный размер батча", ["batcher"]
+)
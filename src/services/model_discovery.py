@@ -5,45 +5,235 @@
 """
 
 import os
-import json
+import re
+import mmap
+import struct
+import orjson
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Iterator, Optional, Tuple, TypedDict
 from loguru import logger
 from huggingface_hub import snapshot_download
 
+MB = 1024 * 1024
+WEIGHT_SUFFIXES = ('.safetensors', '.bin')
+USABLE_WEIGHT_SUFFIXES = ('.bin', '.safetensors', '.pt')  # Файлы весов для проверки пригодности
+SCAN_MAX_WORKERS = 32  # Потоков на анализ папок: чтение с диска отпускает GIL
+MMAP_MIN_SIZE = 4096  # Маленькие конфиги дешевле прочитать целиком, чем отображать в память
+
+# Признаки типа модели: архитектуры - точные имена классов, проверка пересечением множеств;
+# остальное - один проход скомпилированного регулярного выражения вместо any() по спискам
+EMBEDDING_ARCHITECTURES = frozenset({
+    "SentenceTransformer", "Transformer", "EmbeddingModel",
+    "XLMRobertaModel", "MPNetModel", "DistilBertModel"
+})
+LLM_ARCHITECTURES = frozenset({
+    "Qwen2ForCausalLM", "LlamaForCausalLM", "GPT2LMHeadModel",
+    "MistralForCausalLM", "PhiForCausalLM", "BloomForCausalLM"
+})
+_EMBEDDING_MODEL_TYPE_RE = re.compile(r"sentence_transformers|embedding")
+_LLM_MODEL_TYPE_RE = re.compile(r"text-generation|causal-lm")
+_EMBEDDING_NAME_RE = re.compile(r"e5|embedding|sentence|transformers|mpnet|minilm")
+_LLM_NAME_RE = re.compile(r"qwen|chat|instruct|gpt|llama|mistral|phi")
+
+def _load_json(path) -> Any:
+    """
+    JSON-файл через orjson; большие файлы отображаются в память и парсятся без копии в bytes
+    access=ACCESS_READ вместо prot/flags - работает и под Windows
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
+def _scandir_recursive(path: str) -> Iterator[os.DirEntry]:
+    """
+    Все файлы дерева как os.DirEntry: тип и размер берутся из записи каталога,
+    без Path-объекта и лишних stat() на каждый файл, как у rglob + is_file + stat
+    В папки-симлинки не заходим (как rglob), симлинки на файлы (snapshots HF) учитываем
+    """
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+@dataclass(slots=True)
+class FileInfo:
+    """Файл модели: без __dict__ на каждый из сотен файлов кеша; orjson сериализует напрямую"""
+    name: str
+    size_mb: float
+    relative_path: str
+
+class ModelInfo(TypedDict, total=False):
+    """Описание модели в результате сканирования"""
+    name: str
+    display_name: str
+    path: str
+    size_mb: float
+    type: str
+    format: str
+    is_gguf: bool
+    is_hf: bool
+    files: List[FileInfo]
+    is_usable: bool
+    architecture: str
+    model_type: str
+    vocab_size: int
+    hidden_size: int
+    gguf_name: str
+
+# === GGUF ===
+GGUF_MAGIC = 0x46554747  # b"GGUF" little-endian
+GGUF_HEADER_WINDOW = 65536  # general.* ключи идут в начале, веса не читаем
+GGUF_EMBEDDING_ARCHS = frozenset({"bert", "nomic-bert", "jina-bert-v2", "t5encoder"})
+# Тип значения -> формат struct фиксированного размера (8 - строка, 9 - массив)
+_GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?",
+                 10: "<Q", 11: "<q", 12: "<d"}
+_GGUF_STRING, _GGUF_ARRAY = 8, 9
+
+def _gguf_value(buf, offset: int, value_type: int) -> Tuple[Any, int]:
+    """Значение GGUF по смещению: (значение, смещение после него); массивы пропускаются"""
+    if value_type == _GGUF_STRING:
+        (length,) = struct.unpack_from("<Q", buf, offset)
+        start = offset + 8
+        if start + length > len(buf):
+            raise struct.error("string outside header window")
+        return bytes(buf[start:start + length]).decode("utf-8", errors="replace"), start + length
+    if value_type == _GGUF_ARRAY:
+        item_type, count = struct.unpack_from("<IQ", buf, offset)
+        offset += 12
+        if item_type in _GGUF_SCALARS:
+            return None, offset + count * struct.calcsize(_GGUF_SCALARS[item_type])
+        for _ in range(count):
+            _, offset = _gguf_value(buf, offset, item_type)
+        return None, offset
+    fmt = _GGUF_SCALARS[value_type]
+    return struct.unpack_from(fmt, buf, offset)[0], offset + struct.calcsize(fmt)
+
+def _read_gguf_metadata(path: Path) -> Dict[str, Any]:
+    """
+    general.* метаданные из заголовка GGUF (v2/v3) без чтения весов
+    В память отображаются только первые GGUF_HEADER_WINDOW байт файла
+    """
+    metadata: Dict[str, Any] = {}
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        with mmap.mmap(f.fileno(), min(size, GGUF_HEADER_WINDOW), access=mmap.ACCESS_READ) as mm:
+            magic, version = struct.unpack_from("<II", mm, 0)
+            if magic != GGUF_MAGIC or version < 2:
+                return metadata
+            _, kv_count = struct.unpack_from("<QQ", mm, 8)
+            offset = 24
+            try:
+                for _ in range(kv_count):
+                    key, offset = _gguf_value(mm, offset, _GGUF_STRING)
+                    (value_type,) = struct.unpack_from("<I", mm, offset)
+                    value, offset = _gguf_value(mm, offset + 4, value_type)
+                    if key.startswith("general."):
+                        metadata[key] = value
+                    if "general.architecture" in metadata and "general.name" in metadata:
+                        break
+            except (struct.error, KeyError):
+                # Заголовок длиннее окна (большие массивы токенайзера) - берем то, что успели
+                pass
+    return metadata
+
+def _file_key(stat: os.stat_result) -> Optional[Tuple[int, int]]:
+    """
+    (устройство, inode) файла для учета каждого файла один раз, как du
+    В кеше HF snapshots/<hash>/<file> - симлинки на blobs/: без этого модель считается дважды
+    None - файловая система не дает inode (кешированный stat DirEntry под Windows)
+    """
+    return (stat.st_dev, stat.st_ino) if stat.st_ino else None
+
 class ModelDiscoveryService:
     """Обнаружение и анализ моделей в локальном кеше"""
     
     def __init__(self):
         self.models_cache = Path(os.environ.get('HF_HOME', 'storage/models'))
+        # Результат последнего сканирования и сигнатура кеша, для которой он получен
+        self._cache_result: Optional[Dict[str, Any]] = None
+        self._cache_sig: Optional[Tuple] = None
+        # путь -> (mtime_ns, метаданные заголовка GGUF): измененный файл заменяет свою запись
+        self._gguf_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        # путь папки -> (mtime_ns папки, тип модели)
+        self._model_type_cache: Dict[str, Tuple[int, str]] = {}
+    
+    def _cache_signature(self) -> Tuple:
+        """
+        Сигнатура кеша моделей одним scandir верхнего уровня: (имя, mtime_ns, размер)
+        Новая/удаленная модель или изменение в ее папке меняют сигнатуру
+        """
+        with os.scandir(self.models_cache) as entries:
+            return tuple(sorted(
+                (entry.name, stat.st_mtime_ns, stat.st_size)
+                for entry in entries
+                for stat in (entry.stat(),)
+            ))
+    
+    def invalidate_cache(self, removed_path: Optional[Path] = None):
+        """
+        Сброс результата сканирования (модель скачана или удалена)
+        removed_path - удаленная модель: ее записи убираются из кешей типа и заголовков GGUF
+        """
+        self._cache_sig = None
+        if removed_path is not None:
+            removed = str(removed_path)
+            prefix = removed + os.sep
+            for cache in (self._model_type_cache, self._gguf_cache):
+                for key in [key for key in cache if key == removed or key.startswith(prefix)]:
+                    del cache[key]
         
-    def scan_models_cache(self) -> Dict[str, Any]:
+    def scan_models_cache(self, include_files: bool = True) -> Dict[str, Any]:
         """
         Сканирование папки с моделями с поддержкой GGUF и HF форматов
+        Повторный вызов без изменений в кеше возвращает прошлый результат
+        include_files=False - сводка без списков файлов (не кешируется, но полный кеш подходит)
         """
         try:
-            logger.info(f"🔍 Сканирование кеша моделей: {self.models_cache}")
-            
             if not self.models_cache.exists():
                 return {"error": "Папка с моделями не существует", "models": []}
             
-            models_info = []
+            signature = self._cache_signature()
+            if self._cache_result is not None and signature == self._cache_sig:
+                return self._cache_result
+            
+            logger.info(f"🔍 Сканирование кеша моделей: {self.models_cache}")
             
-            # Сканируем ВСЕ элементы в кеше
-            for item in self.models_cache.iterdir():
-                if item.is_file() and item.suffix.lower() == '.gguf':
-                    # Найден GGUF файл - анализируем как LLM модель
-                    model_info = self._analyze_gguf_file(item)
-                    if model_info and self._is_usable_model(model_info):
-                        models_info.append(model_info)
-                        logger.info(f"✅ Найден GGUF: {item.name}")
-                        
-                elif item.is_dir() and self._is_valid_model_directory(item):
-                    # Найдена папка в HF формате
-                    model_info = self.analyze_model_directory(item)
-                    if model_info and self._is_usable_model(model_info):
-                        models_info.append(model_info)
-                        logger.info(f"✅ Найден HF: {item.name} ({model_info.get('type', 'unknown')})")
+            models_info = []
+            model_dirs = []
+            
+            # Сканируем ВСЕ элементы в кеше: тип записи берется из scandir без stat,
+            # Path строится только для найденных моделей
+            with os.scandir(self.models_cache) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith('.gguf'):
+                        # Найден GGUF файл - анализируем как LLM модель
+                        model_info = self._analyze_gguf_file(Path(entry.path))
+                        if model_info and self._is_usable_model(model_info):
+                            models_info.append(model_info)
+                            logger.info(f"✅ Найден GGUF: {entry.name}")
+                            
+                    elif entry.is_dir() and entry.name.startswith('models--') and self._is_valid_model_directory(Path(entry.path)):
+                        # Найдена папка в HF формате - анализ ниже, параллельно с остальными
+                        model_dirs.append(Path(entry.path))
+            
+            # Обход папок и чтение конфигов - ввод-вывод, папки анализируются в пуле потоков
+            if model_dirs:
+                with ThreadPoolExecutor(max_workers=min(SCAN_MAX_WORKERS, len(model_dirs))) as executor:
+                    analyze = functools.partial(self.analyze_model_directory, include_files=include_files)
+                    for item, model_info in zip(model_dirs, executor.map(analyze, model_dirs)):
+                        if model_info and self._is_usable_model(model_info):
+                            models_info.append(model_info)
+                            logger.info(f"✅ Найден HF: {item.name} ({model_info.get('type', 'unknown')})")
             
             # СОРТИРУЕМ модели по типу и качеству
             models_info.sort(key=lambda x: (
@@ -58,28 +248,45 @@ class ModelDiscoveryService:
             }
             
             logger.success(f"📊 Сканирование завершено: {len(models_info)} моделей")
+            if include_files:
+                self._cache_result, self._cache_sig = result, signature
             return result
             
         except Exception as e:
             logger.error(f"❌ Ошибка сканирования моделей: {e}")
             return {"error": str(e), "models": []}
     
-    def _analyze_gguf_file(self, gguf_path: Path) -> Optional[Dict[str, Any]]:
+    def _analyze_gguf_file(self, gguf_path: Path) -> Optional[ModelInfo]:
         """
         Анализирует GGUF файл и возвращает информацию о модели
         """
         try:
-            file_size_mb = gguf_path.stat().st_size / (1024 * 1024)
+            stat = gguf_path.stat()
+            file_size_mb = stat.st_size / (1024 * 1024)
             file_name = gguf_path.name
             
-            # Определяем тип модели по имени файла
+            # Метаданные из заголовка файла, повторные сканирования берут их из кеша
+            cache_key = str(gguf_path)
+            cached = self._gguf_cache.get(cache_key)
+            if cached is not None and cached[0] == stat.st_mtime_ns:
+                metadata = cached[1]
+            else:
+                try:
+                    metadata = _read_gguf_metadata(gguf_path)
+                except (OSError, ValueError, struct.error) as e:
+                    logger.warning(f"Не удалось прочитать заголовок GGUF {file_name}: {e}")
+                    metadata = {}
+                self._gguf_cache[cache_key] = (stat.st_mtime_ns, metadata)
+            architecture = metadata.get("general.architecture")
+            
+            # Тип модели по архитектуре из заголовка, иначе по имени файла
             model_type = "llm"
             lower_name = file_name.lower()
             
-            if any(keyword in lower_name for keyword in ['embedding', 'embed', 'encoder']):
+            if architecture in GGUF_EMBEDDING_ARCHS or any(keyword in lower_name for keyword in ['embedding', 'embed', 'encoder']):
                 model_type = "embedding"
             
-            return {
+            info: ModelInfo = {
                 "name": file_name,
                 "display_name": file_name,  # GGUF файлы имеют понятные имена
                 "path": str(gguf_path),
@@ -88,13 +295,14 @@ class ModelDiscoveryService:
                 "format": "gguf",
                 "is_gguf": True,
                 "is_hf": False,
-                "files": [{
-                    "name": file_name,
-                    "size_mb": round(file_size_mb, 2),
-                    "relative_path": file_name
-                }],
+                "files": [FileInfo(file_name, round(file_size_mb, 2), file_name)],
                 "is_usable": True
             }
+            if architecture:
+                info["architecture"] = architecture
+            if metadata.get("general.name"):
+                info["gguf_name"] = metadata["general.name"]
+            return info
             
         except Exception as e:
             logger.error(f"❌ Ошибка анализа GGUF файла {gguf_path}: {e}")
@@ -110,35 +318,67 @@ class ModelDiscoveryService:
         if not dir_name.startswith('models--'):
             return False
         
-        # ВСЁ ПРОСТО: Проверяем что это реальная модель (есть конфиг)
-        has_config = (model_dir / "config.json").exists()
+        # ВСЁ ПРОСТО: Проверяем что это реальная модель (есть конфиг) - один stat
+        if (model_dir / "config.json").exists():
+            return True
         
-        return has_config
+        # Без рекурсивного обхода blob-дерева: веса рядом или конфиг/веса в snapshots/<hash>/
+        # (стандартный кеш HF), выход на первом совпадении
+        if self._has_model_files(str(model_dir)):
+            return True
+        snapshots = model_dir / "snapshots"
+        if snapshots.is_dir():
+            with os.scandir(snapshots) as entries:
+                for entry in entries:
+                    if entry.is_dir() and (os.path.exists(os.path.join(entry.path, "config.json"))
+                                           or self._has_model_files(entry.path)):
+                        return True
+        return False
+    
+    @staticmethod
+    def _has_model_files(path: str) -> bool:
+        """Есть ли в папке (без вложенных) файл весов"""
+        with os.scandir(path) as entries:
+            return any(entry.name.endswith(WEIGHT_SUFFIXES) and entry.is_file() for entry in entries)
+    
+    @staticmethod
+    def _find_config(model_dir: Path) -> Optional[Path]:
+        """
+        Путь к config.json по известной раскладке: model_dir/ или model_dir/snapshots/<hash>/
+        Полный обход дерева - только если конфиг лежит где-то еще
+        """
+        config_path = model_dir / "config.json"
+        if config_path.exists():
+            return config_path
+        snapshots = model_dir / "snapshots"
+        if snapshots.is_dir():
+            with os.scandir(snapshots) as entries:
+                for entry in entries:
+                    candidate = os.path.join(entry.path, "config.json")
+                    if entry.is_dir() and os.path.exists(candidate):
+                        return Path(candidate)
+        return next(model_dir.rglob("config.json"), None)
     
-    def _is_usable_model(self, model_info: Dict) -> bool:
+    def _is_usable_model(self, model_info: ModelInfo) -> bool:
         """
         Проверяет можно ли использовать модель
         """
         # Для GGUF файлов - всегда используемы если файл существует
         if model_info.get('is_gguf', False):
-            return Path(model_info['path']).exists()
+            return os.path.exists(model_info['path'])
             
         # Для HF моделей - старая логика
         if model_info.get('size_mb', 0) < 1:  # Слишком маленькая
             return False
             
-        if not model_info.get('files'):  # Нет файлов
-            return False
-            
-        # Минимум 1 файл модели и 1 конфиг
-        model_files = [f for f in model_info['files'] if any(ext in f['name'] for ext in ['.bin', '.safetensors', '.pt'])]
-        config_files = [f for f in model_info['files'] if 'config.json' in f['name']]
-        
-        return len(model_files) > 0 and len(config_files) > 0
+        # Минимум 1 файл модели и 1 конфиг - проверено при обходе в analyze_model_directory,
+        # поэтому работает и без списка файлов
+        return model_info.get('is_usable', False)
     
-    def analyze_model_directory(self, model_dir: Path) -> Optional[Dict[str, Any]]:
+    def analyze_model_directory(self, model_dir: Path, include_files: bool = True) -> Optional[ModelInfo]:
         """
         ДЕТАЛЬНЫЙ анализ папки с моделью (HF формат)
+        include_files=False - без списка файлов: размер, конфиг и пригодность для сводок
         """
         try:
             model_name = model_dir.name
@@ -146,11 +386,11 @@ class ModelDiscoveryService:
             # ОПРЕДЕЛЯЕМ ТИП МОДЕЛИ по структуре
             model_type = self._detect_model_type(model_dir)
             
-            info = {
+            info: ModelInfo = {
                 "name": model_name,
                 "display_name": self._get_display_name(model_name),
                 "path": str(model_dir),
-                "size_mb": self.get_directory_size_mb(model_dir),
+                "size_mb": 0.0,
                 "type": model_type,
                 "format": "hf",
                 "is_gguf": False,
@@ -159,18 +399,50 @@ class ModelDiscoveryService:
                 "is_usable": True
             }
             
-            # Анализ файлов
-            for file_path in model_dir.rglob("*"):
-                if file_path.is_file():
-                    file_info = {
-                        "name": file_path.name,
-                        "size_mb": round(file_path.stat().st_size / (1024 * 1024), 2),
-                        "relative_path": str(file_path.relative_to(model_dir))
-                    }
-                    info["files"].append(file_info)
+            # Один обход: список файлов, общий размер, путь к config.json и пригодность
+            # Относительный путь - срез строки вместо Path.relative_to
+            base = str(model_dir)
+            total_size = 0
+            config_path: Optional[str] = None
+            has_weights = has_config = False
+            seen_files = set()
+            
+            # Кеш HF (blobs/ + snapshots/): логический вид - файлы последней ревизии,
+            # физический размер - сумма blobs/ одним scandir; дерево целиком не обходим.
+            # Без симлинков (Windows без Developer Mode) huggingface_hub кладет содержимое
+            # прямо в snapshots/, blobs/ пуст - тогда считаем размер при обходе ревизии
+            layout = self._hf_cache_layout(base)
+            blobs_size = 0
+            if layout is not None:
+                walk_root, blobs = layout
+                blobs_size = self._blobs_size(blobs)
+            else:
+                walk_root = base
+            
+            for entry in _scandir_recursive(walk_root):
+                name = entry.name
+                stat = entry.stat()
+                size = stat.st_size
+                if not blobs_size:
+                    key = _file_key(stat)
+                    if key is None or key not in seen_files:
+                        seen_files.add(key)
+                        total_size += size
+                # Проверки пригодности выключаются, как только признак найден
+                if not has_weights:
+                    has_weights = name.endswith(USABLE_WEIGHT_SUFFIXES)
+                if not has_config:
+                    has_config = name == 'config.json'
+                if include_files:
+                    info["files"].append(FileInfo(name, round(size / MB, 2), entry.path[len(base) + 1:]))
+                # Ближайший к корню config.json - основной конфиг модели
+                if entry.name == "config.json" and (config_path is None or entry.path.count(os.sep) < config_path.count(os.sep)):
+                    config_path = entry.path
+            info["size_mb"] = round((blobs_size or total_size) / MB, 2)
+            info["is_usable"] = has_weights and has_config
             
             # Парсим конфиг для дополнительной информации
-            config_info = self.parse_config_file(model_dir)
+            config_info = self.parse_config_file(model_dir, config_path) if config_path else {}
             info.update(config_info)
             
             return info
@@ -179,7 +451,44 @@ class ModelDiscoveryService:
             logger.warning(f"Ошибка анализа папки {model_dir}: {e}")
             return None
 
+    @staticmethod
+    def _hf_cache_layout(base: str) -> Optional[Tuple[str, str]]:
+        """
+        (папка последней ревизии в snapshots/, папка blobs/) для стандартного кеша HF
+        None - плоская папка (snapshot_download с local_dir)
+        """
+        snapshots = os.path.join(base, "snapshots")
+        blobs = os.path.join(base, "blobs")
+        if not (os.path.isdir(snapshots) and os.path.isdir(blobs)):
+            return None
+        with os.scandir(snapshots) as entries:
+            revisions = [entry for entry in entries if entry.is_dir()]
+        if not revisions:
+            return None
+        latest = max(revisions, key=lambda entry: entry.stat().st_mtime)
+        return latest.path, blobs
+    
+    @staticmethod
+    def _blobs_size(blobs: str) -> int:
+        """Физический размер модели: blobs/ - плоская папка с содержимым файлов"""
+        with os.scandir(blobs) as entries:
+            return sum(entry.stat(follow_symlinks=False).st_size
+                       for entry in entries if entry.is_file(follow_symlinks=False))
+    
     def _detect_model_type(self, model_dir: Path) -> str:
+        """
+        Тип модели с кешем по пути: новые файлы в папке меняют ее mtime и запись пересчитывается
+        """
+        key = str(model_dir)
+        mtime = model_dir.stat().st_mtime_ns
+        cached = self._model_type_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        model_type = self._detect_model_type_uncached(model_dir)
+        self._model_type_cache[key] = (mtime, model_type)
+        return model_type
+    
+    def _detect_model_type_uncached(self, model_dir: Path) -> str:
         """
         Универсальное определение типа модели по стандартам Hugging Face
         Сохраняем ВСЮ старую логику для HF моделей
@@ -193,33 +502,22 @@ class ModelDiscoveryService:
             
         # === 2. ПРОВЕРКА ПО ОСНОВНОМУ CONFIG.JSON ===
         try:
-            config_path = model_dir / "config.json"
-            if config_path.exists():
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                
-                embedding_architectures = [
-                    "SentenceTransformer", "Transformer", "EmbeddingModel",
-                    "XLMRobertaModel", "MPNetModel", "DistilBertModel"
-                ]
-                
-                llm_architectures = [
-                    "Qwen2ForCausalLM", "LlamaForCausalLM", "GPT2LMHeadModel",
-                    "MistralForCausalLM", "PhiForCausalLM", "BloomForCausalLM"
-                ]
+            config_path = self._find_config(model_dir)
+            if config_path is not None:
+                config = _load_json(config_path)
                 
-                architectures = config.get("architectures", [])
+                architectures = set(config.get("architectures") or [])
                 model_type = config.get("model_type", "")
                 
-                if any(arch in str(architectures) for arch in embedding_architectures):
+                if architectures & EMBEDDING_ARCHITECTURES:
                     return "embedding"
                     
-                if any(arch in str(architectures) for arch in llm_architectures):
+                if architectures & LLM_ARCHITECTURES:
                     return "llm"
                 
-                if any(tipo in model_type for tipo in ["sentence_transformers", "embedding"]):
+                if _EMBEDDING_MODEL_TYPE_RE.search(model_type):
                     return "embedding"
-                elif any(tipo in model_type for tipo in ["text-generation", "causal-lm"]):
+                elif _LLM_MODEL_TYPE_RE.search(model_type):
                     return "llm"
                     
         except Exception as e:
@@ -233,18 +531,17 @@ class ModelDiscoveryService:
         # === 4. РЕЗЕРВНЫЙ ВАРИАНТ: ПО ИМЕНИ ПАПКИ ===
         dir_name = model_dir.name.lower()
         
-        embedding_keywords = ['e5', 'embedding', 'sentence', 'transformers', 'mpnet', 'minilm']
-        llm_keywords = ['qwen', 'chat', 'instruct', 'gpt', 'llama', 'mistral', 'phi']
-        
-        if any(keyword in dir_name for keyword in embedding_keywords):
+        if _EMBEDDING_NAME_RE.search(dir_name):
             return "embedding"
-        elif any(keyword in dir_name for keyword in llm_keywords):
+        elif _LLM_NAME_RE.search(dir_name):
             return "llm"
         
         logger.warning(f"Не удалось определить тип модели: {model_dir.name}")
         return "unknown"
     
-    def _get_display_name(self, model_dir_name: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _get_display_name(model_dir_name: str) -> str:
         """
         Преобразует имя папки в читаемое имя модели
         """
@@ -254,19 +551,28 @@ class ModelDiscoveryService:
             return model_dir_name
     
     def get_directory_size_mb(self, directory: Path) -> float:
-        """Вычисление размера папки в MB"""
+        """Вычисление размера папки в MB, файлы под симлинками учитываются один раз"""
         total_size = 0
-        for file_path in directory.rglob("*"):
-            if file_path.is_file():
-                total_size += file_path.stat().st_size
-        return round(total_size / (1024 * 1024), 2)
+        seen_files = set()
+        for entry in _scandir_recursive(str(directory)):
+            stat = entry.stat()
+            key = _file_key(stat)
+            if key is None or key not in seen_files:
+                seen_files.add(key)
+                total_size += stat.st_size
+        return round(total_size / MB, 2)
     
-    def parse_config_file(self, model_dir: Path) -> Dict[str, Any]:
-        """Парсинг config.json для получения метаданных модели"""
+    def parse_config_file(self, model_dir: Path, config_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Парсинг config.json для получения метаданных модели
+        config_path - уже найденный путь к конфигу, без повторного поиска по дереву
+        """
         try:
-            config_path = next(model_dir.rglob("config.json"))
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            if config_path is None:
+                config_path = self._find_config(model_dir)
+            if config_path is None:
+                return {}
+            config = _load_json(config_path)
             
             info = {}
             
@@ -293,7 +599,8 @@ class ModelDiscoveryService:
         Анализ кеша на наличие битых и неиспользуемых моделей
         """
         try:
-            cache_info = self.scan_models_cache()
+            # Нужны только имена и пригодность - списки файлов не строим
+            cache_info = self.scan_models_cache(include_files=False)
             broken_models = []
             
             for model in cache_info.get("models", []):
@@ -344,6 +651,7 @@ class ModelDiscoveryService:
                 else:
                     shutil.rmtree(local_path)  # Удаляем HF папку
                 logger.info(f"Модель {model_name} удалена из кеша")
+                self.invalidate_cache(removed_path=local_path)
                 return True
             logger.warning(f"Модель {model_name} не найдена для удаления: {local_path}")
             return False
@@ -368,6 +676,7 @@ class ModelDiscoveryService:
             )
             
             logger.info(f"Модель {model_id} успешно скачана в {local_dir}")
+            self.invalidate_cache()
             return True
             
         except Exception as e:
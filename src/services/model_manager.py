@@ -6,19 +6,107 @@
 
 import os
 import gc
+import sys
+import ctypes
+import asyncio
+import functools
+import threading
+import contextlib
+from collections import Counter
+from dataclasses import dataclass
+
+# Настройки кеширующего аллокатора CUDA - до первого обращения torch к GPU.
+# expandable_segments растит/сжимает сегменты без фрагментации (поддерживается только под Linux),
+# garbage_collection_threshold возвращает неиспользуемые блоки до того, как случится OOM
+_ALLOC_CONF = "garbage_collection_threshold:0.8,max_split_size_mb:512"
+if sys.platform.startswith('linux'):
+    _ALLOC_CONF = "expandable_segments:True," + _ALLOC_CONF
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", _ALLOC_CONF)
+
+# ЗАПРЕТ на автозагрузку через переменные окружения - один раз при импорте, а не на каждой загрузке.
+# До импорта transformers: флаги offline читаются при его инициализации
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+os.environ.setdefault('HF_DATASETS_OFFLINE', '1')
+
 import torch
-from typing import Dict, Any, Optional
+from typing import Dict, Any, FrozenSet, Optional
 from loguru import logger
 from pathlib import Path
+# Тяжелые импорты - один раз при старте, а не на первой загрузке модели в запросе
+from sentence_transformers import SentenceTransformer
+from transformers import AutoModel, AutoModelForCausalLM, AutoTokenizer, pipeline
+
+from services.batch_processor import batch_processor
+
+# Квантование весов предзагружаемой эмбеддинг-модели: "int8" (bitsandbytes) или пусто - без квантования.
+# По умолчанию выключено: bitsandbytes нестабилен под Windows
+EMBED_QUANT = os.environ.get('EMBED_QUANT', '').lower() or None
+# torch.compile для трансформера эмбеддинг-моделей: слияние ядер вместо eager-диспетчеризации.
+# По умолчанию выключено: inductor требует Triton, которого обычно нет под Windows
+EMBED_COMPILE = os.environ.get('EMBED_COMPILE', '').lower() in ('1', 'true', 'yes')
+# Режим torch.compile: "reduce-overhead" дополнительно захватывает CUDA graph на каждую форму (батч, длина)
+# и проигрывает весь forward одним вызовом драйвера. Корзины длины в батчере держат число форм небольшим
+EMBED_COMPILE_MODE = os.environ.get('EMBED_COMPILE_MODE', 'default')
+
+@dataclass(slots=True)
+class ModelEntry:
+    """Загруженная модель: слоты вместо словаря на запись, модель - единственная сильная ссылка"""
+    type: str
+    model: Any
+    device: torch.device
+    local_path: str
+    quantization: Optional[str] = None
+    status: str = 'loaded'
+
+def _malloc_trim():
+    """Возвращает освободившуюся кучу glibc операционной системе (только Linux)"""
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        # musl и прочие libc без malloc_trim
+        pass
 
 class ModelManager:
     """Управление жизненным циклом AI-моделей"""
     
     def __init__(self):
-        self.loaded_models: Dict[str, Any] = {}
+        self.loaded_models: Dict[str, ModelEntry] = {}
+        # Имя -> тип и число моделей по типам, обновляются при загрузке/выгрузке:
+        # статистика отдается без обхода loaded_models
+        self._loaded_types: Dict[str, str] = {}
+        self._type_counts: Counter = Counter()
+        # Реестр меняют потоки загрузки разных моделей - записи и снимки для статистики под одной блокировкой
+        self._registry_lock = threading.Lock()
         self.models_cache = Path(os.environ.get('HF_HOME', 'storage/models'))
+        # Имена папок моделей в кеше: один scandir вместо stat() на каждый поиск пути.
+        # Заполняется лениво, сбрасывается после удаления модели
+        self._available_models: Optional[FrozenSet[str]] = None
+        # Загрузка/выгрузка идут в потоках: одна модель - один поток за раз
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
         
-    def _normalize_model_name(self, model_name: str) -> str:
+        # Наличие CUDA не меняется за время жизни процесса - опрашиваем драйвер один раз
+        self._cuda_available = torch.cuda.is_available()
+        self._device = 'cuda' if self._cuda_available else 'cpu'
+        # Один объект устройства на все модели: .to() и сравнения без разбора строки
+        self._torch_device = torch.device(self._device)
+        
+        # Точность вычислений эмбеддингов: bf16 на Ampere+, fp16 на старых GPU, fp32 на CPU
+        if self._cuda_available:
+            self.active_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            # Оставшиеся fp32-матмулы - на тензорных ядрах
+            torch.backends.cuda.matmul.allow_tf32 = True
+            # Отдельный CUDA-поток для эмбеддингов: forward не встает в очередь за генерацией LLM
+            self.embedding_stream = torch.cuda.Stream()
+        else:
+            self.embedding_stream = None
+            self.active_dtype = torch.float32
+        
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _normalize_model_name(model_name: str) -> str:
         """Нормализует имя модели к стандартному формату HF кеша"""
         if model_name.startswith('models--'):
             return model_name  # Уже нормализовано
@@ -27,27 +115,106 @@ class ModelManager:
         else:
             return model_name  # Оставляем как есть
     
-    def preload_essential_models(self):
-        """Предзагрузка основных моделей при старте сервера"""
+    async def preload_essential_models(self):
+        """
+        Предзагрузка основных моделей при старте сервера
+        Модели грузятся параллельно, каждая в своем потоке: чтение весов с диска перекрывается
+        """
         essential_models = {
             "intfloat/multilingual-e5-large-instruct": "embedding"
         }
         
-        for model_name, model_type in essential_models.items():
-            if self._get_local_model_path(model_name):
-                if self.load_model(model_name, model_type):
-                    logger.info(f"✅ Предзагружена: {model_name}")
-                else:
-                    logger.warning(f"⚠️ Не удалось предзагрузить: {model_name}")
-            else:
+        async def preload(model_name: str, model_type: str):
+            if not self._get_local_model_path(model_name):
                 logger.warning(f"⚠️ Модель {model_name} не найдена для предзагрузки")
+                return
+            quantization = EMBED_QUANT if model_type == 'embedding' else None
+            if await self.load_model_async(model_name, model_type, quantization=quantization):
+                logger.info(f"✅ Предзагружена: {model_name}")
+            else:
+                logger.warning(f"⚠️ Не удалось предзагрузить: {model_name}")
+        
+        await asyncio.gather(*(
+            preload(model_name, model_type) for model_name, model_type in essential_models.items()
+        ))
+
+    def inference_context(self) -> contextlib.ExitStack:
+        """
+        Контекст прямого прохода эмбеддинг-модели: без autograd и в пониженной точности на GPU
+        Половина байт на активацию - вдвое больший батч при той же VRAM
+        Работа идет в embedding_stream: результат копировать на CPU внутри контекста
+        """
+        stack = contextlib.ExitStack()
+        if self.embedding_stream is not None:
+            # Веса и входы могли быть записаны в основном потоке - ждем его
+            self.embedding_stream.wait_stream(torch.cuda.current_stream())
+            stack.enter_context(torch.cuda.stream(self.embedding_stream))
+        stack.enter_context(torch.inference_mode())
+        if self.active_dtype != torch.float32:
+            stack.enter_context(torch.autocast(device_type='cuda', dtype=self.active_dtype))
+        return stack
+    
+    def _model_lock(self, normalized_name: str) -> threading.Lock:
+        """Блокировка конкретной модели: два одновременных запроса не грузят ее дважды"""
+        with self._locks_guard:
+            return self._locks.setdefault(normalized_name, threading.Lock())
 
     def is_model_loaded(self, model_name: str) -> bool:
         """Проверяет загружена ли модель (с нормализацией имени)"""
         normalized_name = self._normalize_model_name(model_name)
         return normalized_name in self.loaded_models
         
-    def load_model(self, model_name: str, model_type: str, **kwargs) -> bool:
+    async def load_model_async(self, model_name: str, model_type: str, quantization: Optional[str] = None, **kwargs) -> bool:
+        """Загрузка модели в потоке: event loop продолжает обслуживать запросы"""
+        return await asyncio.to_thread(self.load_model, model_name, model_type, quantization=quantization, **kwargs)
+    
+    def load_model(self, model_name: str, model_type: str, quantization: Optional[str] = None, **kwargs) -> bool:
+        """
+        Загрузка модели (блокирующая, из async-кода вызывать через asyncio.to_thread)
+        quantization="int8" - веса эмбеддинг-модели в INT8 (bitsandbytes)
+        """
+        with self._model_lock(self._normalize_model_name(model_name)):
+            try:
+                return self._load_model(model_name, model_type, quantization=quantization, **kwargs)
+            finally:
+                # Занятая память GPU изменилась - старый max_volume неверен
+                batch_processor.invalidate_max_volume()
+
+    @staticmethod
+    def _quantize_embedding_int8(model: Any):
+        """
+        Weight-only INT8: веса трансформера перезагружаются через bitsandbytes,
+        активации остаются в fp16 - вдвое меньше байт весов на каждый forward
+        """
+        transformer = model[0]
+        source = transformer.auto_model.config._name_or_path
+        transformer.auto_model = AutoModel.from_pretrained(
+            source,
+            load_in_8bit=True,
+            device_map="auto"
+        )
+        # Исходные fp-веса больше не нужны
+        gc.collect()
+        torch.cuda.empty_cache()
+    
+    def _compile_embedding(self, model) -> bool:
+        """
+        Компилирует трансформер SentenceTransformer через torch.compile
+        Компиляция ленивая, поэтому сразу делаем прогрев: ошибка всплывет здесь, а не в запросе
+        """
+        transformer = model[0]
+        eager_model = transformer.auto_model
+        try:
+            transformer.auto_model = torch.compile(eager_model, mode=EMBED_COMPILE_MODE, dynamic=True, fullgraph=False)
+            with self.inference_context():
+                model.encode(["warmup"], convert_to_tensor=True, show_progress_bar=False)
+            return True
+        except Exception as e:
+            transformer.auto_model = eager_model
+            logger.warning(f"⚠️ torch.compile не применен: {e}")
+            return False
+    
+    def _load_model(self, model_name: str, model_type: str, quantization: Optional[str] = None, **kwargs) -> bool:
         try:
             # Нормализуем имя ДО проверки
             normalized_name = self._normalize_model_name(model_name)
@@ -63,42 +230,61 @@ class ModelManager:
                 logger.error(f"🚫 ЗАПРЕЩЕНО: Модель {model_name} не найдена в локальном кеше")
                 return False
             
-            # ЗАПРЕТ на автозагрузку через переменные окружения
-            os.environ['TRANSFORMERS_OFFLINE'] = '1'
-            os.environ['HF_DATASETS_OFFLINE'] = '1'
-            
             # ЗАГРУЖАЕМ ИСКЛЮЧИТЕЛЬНО ИЗ ЛОКАЛЬНОГО ПУТЯ!
             if model_type == 'embedding':
-                from sentence_transformers import SentenceTransformer
                 try:
                     # ЗАГРУЖАЕМ ПРЯМО ИЗ ПУТИ!
                     model = SentenceTransformer(
                         str(local_path),  # ← ВОТ ОНО! ЛОКАЛЬНЫЙ ПУТЬ!
-                        device='cuda' if torch.cuda.is_available() else 'cpu'
+                        device=self._torch_device
                     )
                 except Exception as e:
                     logger.error(f"Ошибка загрузки SentenceTransformer: {e}")
                     return False
+                
+                if quantization == 'int8':
+                    if not self._cuda_available:
+                        logger.warning(f"⚠️ INT8 требует CUDA, {normalized_name} остается в исходной точности")
+                        quantization = None
+                    else:
+                        try:
+                            self._quantize_embedding_int8(model)
+                            logger.info(f"🗜️ {normalized_name}: веса в INT8")
+                        except Exception as e:
+                            logger.warning(f"⚠️ INT8 не применен к {normalized_name}: {e}")
+                            quantization = None
+                elif quantization:
+                    logger.warning(f"⚠️ Неподдерживаемое квантование эмбеддингов: {quantization}")
+                    quantization = None
+                
+                # INT8-слои bitsandbytes не компилируются - только для моделей без квантования
+                if EMBED_COMPILE and not quantization and self._compile_embedding(model):
+                    logger.info(f"⚙️ {normalized_name}: forward скомпилирован torch.compile ({EMBED_COMPILE_MODE})")
                     
             elif model_type == 'llm':
-                from transformers import pipeline
-                model = pipeline(
-                    "text-generation",
-                    model=str(local_path),  # ← ВОТ ОНО! ЛОКАЛЬНЫЙ ПУТЬ!
-                    tokenizer=str(local_path),
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                    device_map="auto" if torch.cuda.is_available() else None
+                tokenizer = AutoTokenizer.from_pretrained(str(local_path))
+                # Веса читаются через mmap (safetensors предпочитается, если есть) и сразу
+                # раскладываются по устройствам: полная копия state dict в RAM не собирается
+                llm = AutoModelForCausalLM.from_pretrained(
+                    str(local_path),  # ← ВОТ ОНО! ЛОКАЛЬНЫЙ ПУТЬ!
+                    low_cpu_mem_usage=True,
+                    torch_dtype=torch.float16 if self._cuda_available else torch.float32,
+                    device_map="auto" if self._cuda_available else None
                 )
+                model = pipeline("text-generation", model=llm, tokenizer=tokenizer)
             else:
                 raise ValueError(f"Неподдерживаемый тип модели: {model_type}")
             
-            self.loaded_models[normalized_name] = {
-                'type': model_type,
-                'status': 'loaded',
-                'model': model,
-                'device': 'cuda' if torch.cuda.is_available() else 'cpu',
-                'local_path': str(local_path)
-            }
+            with self._registry_lock:
+                self.loaded_models[normalized_name] = ModelEntry(
+                    type=model_type,
+                    model=model,
+                    device=self._torch_device,
+                    local_path=str(local_path),
+                    quantization=quantization
+                )
+                self._loaded_types[normalized_name] = model_type
+                self._type_counts[model_type] += 1
             
             logger.success(f"Модель {normalized_name} успешно загружена из локального кеша")
             return True
@@ -113,16 +299,39 @@ class ModelManager:
         # 🔴 ИСПРАВЛЕНИЕ: Всегда нормализуем имя для поиска в кеше
         normalized_name = self._normalize_model_name(model_name)
         
-        путь = self.models_cache / normalized_name
-        if путь.exists():
-            logger.info(f"Найден путь: {путь}")
-            return путь
+        available = self._available_models
+        if available is None or normalized_name not in available:
+            # Промах - модель могли скачать после прошлого сканирования, пересканируем
+            available = self._refresh_available_models()
+        if normalized_name in available:
+            return self.models_cache / normalized_name
         
         logger.error(f"Модель {model_name} (нормализовано: {normalized_name}) не найдена в кеше")
         return None
     
+    def _refresh_available_models(self) -> FrozenSet[str]:
+        """Перечитывает список папок моделей в локальном кеше"""
+        try:
+            with os.scandir(self.models_cache) as entries:
+                available = frozenset(entry.name for entry in entries if entry.is_dir())
+        except FileNotFoundError:
+            available = frozenset()
+        self._available_models = available
+        return available
+    
+    def invalidate_local_models(self):
+        """Сбрасывает список моделей в кеше (после удаления модели)"""
+        self._available_models = None
+    
     def unload_model(self, model_name: str) -> bool:
         """Выгрузка модели из памяти"""
+        with self._model_lock(self._normalize_model_name(model_name)):
+            try:
+                return self._unload_model(model_name)
+            finally:
+                batch_processor.invalidate_max_volume()
+
+    def _unload_model(self, model_name: str) -> bool:
         try:
             normalized_name = self._normalize_model_name(model_name)
             if normalized_name not in self.loaded_models:
@@ -132,14 +341,23 @@ class ModelManager:
             logger.info(f"Выгрузка модели: {normalized_name}")
             
             # Освобождаем ресурсы
-            model_info = self.loaded_models.pop(normalized_name)
-            if model_info.get('model'):
-                del model_info['model']
+            # Сначала отпускаем ВСЕ ссылки на модель, только потом gc и empty_cache -
+            # иначе блоки весов остаются занятыми в кеширующем аллокаторе
+            with self._registry_lock:
+                entry = self.loaded_models.pop(normalized_name)
+                self._type_counts[self._loaded_types.pop(normalized_name)] -= 1
+            entry.model = None
+            del entry
                 
             # Принудительная сборка мусора
             gc.collect()
-            if torch.cuda.is_available():
+            if self._cuda_available:
+                # Ждем ядра, еще читающие веса, и возвращаем освободившиеся блоки
+                # кеширующего аллокатора драйверу (и IPC-память, если ее делили процессы)
+                torch.cuda.synchronize()
                 torch.cuda.empty_cache()
+                torch.cuda.ipc_collect()
+            _malloc_trim()
             
             logger.success(f"Модель {normalized_name} успешно выгружена")
             return True
@@ -152,28 +370,28 @@ class ModelManager:
         """Получение загруженной модели"""
         normalized_name = self._normalize_model_name(model_name)
         if normalized_name in self.loaded_models:
-            return self.loaded_models[normalized_name]['model']
+            return self.loaded_models[normalized_name].model
         return None
     
-    def get_model_info(self, model_name: str) -> Optional[Dict]:
+    def get_model_info(self, model_name: str) -> Optional[ModelEntry]:
         """Получение информации о модели"""
         normalized_name = self._normalize_model_name(model_name)
         return self.loaded_models.get(normalized_name)
     
     def list_loaded_models(self) -> Dict[str, str]:
-        """Список загруженных моделей"""
-        return {name: info['type'] for name, info in self.loaded_models.items()}
+        """Список загруженных моделей: копия реестра, снятая под блокировкой"""
+        with self._registry_lock:
+            return dict(self._loaded_types)
     
     def get_model_stats(self) -> Dict[str, Any]:
-        """Базовая статистика по моделям"""
-        return {
-            'total_loaded': len(self.loaded_models),
-            'embedding_models': sum(1 for info in self.loaded_models.values() 
-                                  if info['type'] == 'embedding'),
-            'llm_models': sum(1 for info in self.loaded_models.values() 
-                            if info['type'] == 'llm'),
-            'models': self.list_loaded_models()
-        }
+        """Базовая статистика по моделям: счетчики ведутся при загрузке/выгрузке, без обхода моделей"""
+        with self._registry_lock:
+            return {
+                'total_loaded': len(self.loaded_models),
+                'embedding_models': self._type_counts['embedding'],
+                'llm_models': self._type_counts['llm'],
+                'models': dict(self._loaded_types)
+            }
 
 # Глобальный экземпляр менеджера моделей
 model_manager = ModelManager()
\ No newline at end of file
@@ -4,47 +4,222 @@
 """
 
 import os
+import re
+import time
+import functools
+import threading
 import torch
+import numpy as np
+from collections import namedtuple
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 from loguru import logger
 
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
+GPU_INFO_TTL = 1.0  # секунд
+
+# Модели для дашборда рекомендаций; кеш рекомендаций прогревается для них при старте
+POPULAR_MODELS: Tuple[str, ...] = (
+    "Qwen/Qwen2.5-7B-Instruct",
+    "microsoft/DialoGPT-medium",
+    "sentence-transformers/all-MiniLM-L6-v2",
+    "sentence-transformers/all-mpnet-base-v2",
+    "intfloat/multilingual-e5-large-instruct",
+    "mistralai/Mistral-7B-Instruct-v0.2",
+    "google/flan-t5-large"
+)
+SUGGESTIONS_CACHE_SIZE = 256
+FREE_VRAM_BUCKET_GB = 2  # Рекомендации пересчитываются, когда свободная VRAM сдвигается на 2 GB
+
+# Уровни квантования: доля размера весов относительно fp32 и ожидаемое качество
+QuantLevel = namedtuple('QuantLevel', 'name bits reduction quality')
+QUANTIZATION_LEVELS: Tuple[QuantLevel, ...] = (
+    QuantLevel("fp32", 32, 1.0, "original"),
+    QuantLevel("fp16", 16, 0.5, "excellent"),
+    QuantLevel("bf16", 16, 0.5, "excellent"),
+    QuantLevel("8bit", 8, 0.25, "very good"),
+    QuantLevel("4bit", 4, 0.125, "good"),
+    QuantLevel("q4", 4, 0.125, "good"),
+)
+SAFETY_MARGIN = 1.2  # 20% запас для overhead
+# Эмпирические оценки размеров популярных моделей, GB (ключи в нижнем регистре)
+MODEL_SIZE_ESTIMATIONS: Dict[str, float] = {
+    "qwen2.5-7b": 14.5,
+    "qwen2.5-14b": 28.0,
+    "qwen2-7b": 14.0,
+    "qwen2-1.5b": 3.0,
+    "llama-3-8b": 16.0,
+    "llama-3-70b": 140.0,
+    "mistral-7b": 14.0,
+    "mixtral-8x7b": 45.0,
+    "all-minilm-l6-v2": 0.09,
+    "all-mpnet-base-v2": 0.42,
+    "paraphrase-multilingual-mpnet-base-v2": 2.1,
+    "multilingual-e5-large": 2.2
+}
+# Все известные имена одной альтернацией: один проход по строке вместо цикла с lower() и in
+_MODEL_SIZE_RE = re.compile("|".join(map(re.escape, MODEL_SIZE_ESTIMATIONS)), re.IGNORECASE)
+# Эвристика по числу параметров для моделей вне списка
+_PARAM_SIZE_ESTIMATIONS = (("7b", 14.0), ("13b", 26.0), ("70b", 140.0))
+
+# Шаблоны человеко-читаемых рекомендаций: заполняются одним format_map по полям анализа
+SUGGESTION_HEADER = (
+    "💾 Размер модели: {model_size} GB",
+    "🎮 Доступно VRAM: {free_vram} GB"
+)
+SUGGESTIONS_CAN_LOAD = (
+    "✅ Рекомендуется: {level} ({bits}-bit)",
+    "📊 Качество: {quality}",
+    "🔮 Займет VRAM: ~{estimated_size_gb} GB"
+)
+SUGGESTIONS_CANNOT_LOAD = (
+    "⚠️  Модель не влезает в доступную память",
+    "💡 Можно попробовать: {level} ({bits}-bit)",
+    "🔮 Потребуется: ~{required_vram_gb} GB",
+    "🚨 Возможны проблемы с производительностью"
+)
+ALTERNATIVE_SUGGESTION = "   • {level} ({bits}-bit) - {estimated_size_gb} GB"
+
+# Коэффициенты уровней одним массивом: оценка всех уровней - один проход ufunc
+LEVEL_REDUCTIONS = np.array([level.reduction for level in QUANTIZATION_LEVELS], dtype=np.float64)
+
 class QuantizationService:
     """Сервис для автоматического квантования моделей под доступные ресурсы"""
     
     def __init__(self):
+        # Папка создается при первом квантовании, а не при импорте модуля
         self.quantized_models_cache = Path(os.environ.get('HF_HOME', 'storage/models')) / "quantized"
-        self.quantized_models_cache.mkdir(exist_ok=True)
+        self._cache_dir_ready = False
+        # (имя модели, корзина свободной VRAM) -> результат generate_quantization_suggestions
+        self._suggestions_cache: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        # Анализы моделей идут параллельно в потоках
+        self._suggestions_lock = threading.Lock()
+        # Неизменные свойства GPU и хэндлы NVML - заполняются при первом опросе
+        self._gpu_static: Optional[List[Dict[str, Any]]] = None
+        self._nvml_handles: Optional[List[Any]] = None
+        self._gpu_info_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+        # Анализы идут параллельно в потоках - NVML инициализируется один раз
+        self._gpu_init_lock = threading.Lock()
+        # Наличие CUDA не меняется за время жизни процесса
+        self._cuda_available = torch.cuda.is_available()
         
+    def invalidate_cache(self):
+        """Сброс кеша рекомендаций (модель загружена/выгружена - VRAM изменилась)"""
+        self._suggestions_cache.clear()
+        
+    def _init_gpu_handles(self):
+        """
+        Один раз: неизменные свойства GPU и хэндлы NVML для тех же устройств
+        Дальше каждый опрос памяти - дешевое чтение через готовый хэндл
+        """
+        if self._gpu_static is not None:
+            return
+        with self._gpu_init_lock:
+            if self._gpu_static is None:
+                self._init_gpu_handles_locked()
+    
+    def _init_gpu_handles_locked(self):
+        # Перечисляем устройства в порядке CUDA (с учетом CUDA_VISIBLE_DEVICES и FASTEST_FIRST):
+        # тем же индексом дальше читаются memory_allocated/memory_reserved
+        static = []
+        for i in range(torch.cuda.device_count()):
+            props = torch.cuda.get_device_properties(i)
+            static.append({
+                "name": props.name,
+                "total_memory": props.total_memory,
+                "compute_capability": f"{props.major}.{props.minor}",
+                "multi_processor_count": props.multi_processor_count,
+                "pci_bus_id": self._pci_bus_id(props)
+            })
+        if NVML_AVAILABLE:
+            try:
+                self._nvml_handles = self._nvml_handles_for(static)
+            except Exception as e:
+                logger.warning(f"⚠️ NVML недоступен, используем torch.cuda: {e}")
+                self._nvml_handles = None
+        self._gpu_static = static
+    
+    @staticmethod
+    def _pci_bus_id(props) -> Optional[str]:
+        """PCI-адрес устройства в формате NVML, если torch его сообщает"""
+        bus = getattr(props, "pci_bus_id", None)
+        if bus is None:
+            return None
+        domain = getattr(props, "pci_domain_id", 0)
+        device = getattr(props, "pci_device_id", 0)
+        return f"{domain:08X}:{bus:02X}:{device:02X}.0"
+    
+    @staticmethod
+    def _nvml_handles_for(static: List[Dict[str, Any]]) -> List[Optional[Any]]:
+        """
+        Хэндлы NVML для CUDA-устройств по PCI-адресу: порядок NVML - физический (PCI)
+        и включает скрытые GPU, поэтому индексы NVML и CUDA сопоставлять нельзя
+        None - хэндл не найден, свободная память устройства считается через torch
+        """
+        pynvml.nvmlInit()
+        handles = []
+        for device in static:
+            handle = None
+            if device["pci_bus_id"] is not None:
+                try:
+                    handle = pynvml.nvmlDeviceGetHandleByPciBusId(device["pci_bus_id"].encode())
+                except pynvml.NVMLError as e:
+                    logger.warning(f"⚠️ NVML: устройство {device['pci_bus_id']} не найдено: {e}")
+            handles.append(handle)
+        return handles
+    
+    def shutdown(self):
+        """Закрытие NVML (вызывается из lifespan)"""
+        if self._nvml_handles is not None:
+            pynvml.nvmlShutdown()
+            self._nvml_handles = None
+    
     def get_gpu_memory_info(self) -> Dict[str, Any]:
         """
         Получение детальной информации о GPU памяти
+        Результат кешируется на GPU_INFO_TTL: дашборды опрашивают чаще, чем меняется память
         """
+        now = time.monotonic()
+        cached_at, cached = self._gpu_info_cache
+        if cached is not None and now - cached_at < GPU_INFO_TTL:
+            return cached
+        
         try:
-            if not torch.cuda.is_available():
+            if not self._cuda_available:
                 return {
                     "available": False,
                     "error": "CUDA not available", 
                     "gpus": {}
                 }
             
+            self._init_gpu_handles()
+            
             gpu_info = {}
-            for i in range(torch.cuda.device_count()):
-                props = torch.cuda.get_device_properties(i)
+            for i, static in enumerate(self._gpu_static):
                 allocated = torch.cuda.memory_allocated(i) / (1024**3)  # GB
                 reserved = torch.cuda.memory_reserved(i) / (1024**3)    # GB
-                total = props.total_memory / (1024**3)                  # GB
-                free = total - allocated
+                total = static["total_memory"] / (1024**3)              # GB
+                handle = self._nvml_handles[i] if self._nvml_handles is not None else None
+                if handle is not None:
+                    # Свободная память всего устройства, с учетом других процессов
+                    free = pynvml.nvmlDeviceGetMemoryInfo(handle).free / (1024**3)
+                else:
+                    free = total - allocated
                 
                 gpu_info[f"cuda:{i}"] = {
-                    "name": props.name,
+                    "name": static["name"],
                     "total_gb": round(total, 2),
                     "allocated_gb": round(allocated, 2),
                     "reserved_gb": round(reserved, 2),
                     "free_gb": round(free, 2),
                     "free_percent": round((free / total) * 100, 1),
-                    "compute_capability": f"{props.major}.{props.minor}",
-                    "multi_processor_count": props.multi_processor_count
+                    "compute_capability": static["compute_capability"],
+                    "multi_processor_count": static["multi_processor_count"]
                 }
             
             result = {
@@ -55,6 +230,7 @@ class QuantizationService:
             if gpu_info:
                 result["primary_gpu"] = list(gpu_info.keys())[0]
             
+            self._gpu_info_cache = (now, result)
             return result
             
         except Exception as e:
@@ -65,6 +241,29 @@ class QuantizationService:
                 "gpus": {}
             }
     
+    @staticmethod
+    def _score_levels(model_size_gb: float, free_vram: float, total_vram: float) -> List[Dict[str, Any]]:
+        """Оценка всех уровней квантования разом: размер, требуемая VRAM и влезает ли модель"""
+        sizes = model_size_gb * LEVEL_REDUCTIONS
+        required = sizes * SAFETY_MARGIN
+        can_fit = (required <= free_vram).tolist()
+        usage_percent = np.round(required / total_vram * 100, 1).tolist()
+        sizes = np.round(sizes, 2).tolist()
+        required = np.round(required, 2).tolist()
+        return [
+            {
+                "level": level.name,
+                "bits": level.bits,
+                "estimated_size_gb": sizes[i],
+                "required_vram_gb": required[i],
+                "can_fit": can_fit[i],
+                "vram_usage_percent": usage_percent[i],
+                "quality": level.quality,
+                "recommended": can_fit[i] and level.bits <= 8  # Предпочитаем 8-bit или меньше
+            }
+            for i, level in enumerate(QUANTIZATION_LEVELS)
+        ]
+    
     def calculate_optimal_quantization(self, model_size_gb: float, target_device: str = "cuda:0") -> Dict[str, Any]:
         """
         Расчет оптимального уровня квантования для модели
@@ -98,36 +297,7 @@ class QuantizationService:
         free_vram = target_gpu["free_gb"]
         total_vram = target_gpu["total_gb"]
         
-        # Расчет коэффициентов квантования
-        quantization_levels = {
-            "fp32": {"bits": 32, "reduction": 1.0, "quality": "original"},
-            "fp16": {"bits": 16, "reduction": 0.5, "quality": "excellent"}, 
-            "bf16": {"bits": 16, "reduction": 0.5, "quality": "excellent"},
-            "8bit": {"bits": 8, "reduction": 0.25, "quality": "very good"},
-            "4bit": {"bits": 4, "reduction": 0.125, "quality": "good"},
-            "q4": {"bits": 4, "reduction": 0.125, "quality": "good"}
-        }
-        
-        recommendations = []
-        
-        for level_name, level_info in quantization_levels.items():
-            estimated_size = model_size_gb * level_info["reduction"]
-            safety_margin = 1.2  # 20% запас для overhead
-            required_vram = estimated_size * safety_margin
-            
-            can_fit = required_vram <= free_vram
-            vram_usage_percent = (required_vram / total_vram) * 100
-            
-            recommendations.append({
-                "level": level_name,
-                "bits": level_info["bits"],
-                "estimated_size_gb": round(estimated_size, 2),
-                "required_vram_gb": round(required_vram, 2),
-                "can_fit": can_fit,
-                "vram_usage_percent": round(vram_usage_percent, 1),
-                "quality": level_info["quality"],
-                "recommended": can_fit and level_info["bits"] <= 8  # Предпочитаем 8-bit или меньше
-            })
+        recommendations = self._score_levels(model_size_gb, free_vram, total_vram)
         
         # Сортируем по приоритету (сначала те что влезают, потом по качеству)
         recommendations.sort(key=lambda x: (not x["can_fit"], x["bits"]))
@@ -155,85 +325,83 @@ class QuantizationService:
             "can_load": best_recommendation["can_fit"] if not best_recommendation.get("forced") else False
         }
     
+    @functools.lru_cache(maxsize=256)
     def get_model_size_estimation(self, model_name: str) -> float:
         """
         Оценка размера модели по её имени и конфигурации
         """
-        # Эмпирические оценки размеров популярных моделей
-        model_size_estimations = {
-            "Qwen2.5-7B": 14.5,
-            "Qwen2.5-14B": 28.0,
-            "Qwen2-7B": 14.0,
-            "Qwen2-1.5B": 3.0,
-            "Llama-3-8B": 16.0,
-            "Llama-3-70B": 140.0,
-            "mistral-7b": 14.0,
-            "mixtral-8x7b": 45.0,
-            "all-MiniLM-L6-v2": 0.09,
-            "all-mpnet-base-v2": 0.42,
-            "paraphrase-multilingual-mpnet-base-v2": 2.1,
-            "multilingual-e5-large": 2.2
-        }
-        
-        # Ищем подходящую оценку
-        for pattern, size in model_size_estimations.items():
-            if pattern.lower() in model_name.lower():
-                return size
+        match = _MODEL_SIZE_RE.search(model_name)
+        if match:
+            return MODEL_SIZE_ESTIMATIONS[match.group(0).lower()]
         
         # Если модель не найдена в списке, используем эвристику
-        if "7b" in model_name.lower() or "7B" in model_name:
-            return 14.0
-        elif "13b" in model_name.lower() or "13B" in model_name:
-            return 26.0
-        elif "70b" in model_name.lower() or "70B" in model_name:
-            return 140.0
-        else:
-            return 2.0  # Дефолтная оценка для неизвестных моделей
+        name = model_name.lower()
+        for marker, size in _PARAM_SIZE_ESTIMATIONS:
+            if marker in name:
+                return size
+        return 2.0  # Дефолтная оценка для неизвестных моделей
     
     def generate_quantization_suggestions(self, model_name: str) -> Dict[str, Any]:
         """
         Генерация предложений по квантованию для конкретной модели
+        Результат кешируется по имени модели и корзине свободной VRAM
         """
+        gpu_info = self.get_gpu_memory_info()
+        primary = gpu_info["gpus"].get(gpu_info.get("primary_gpu"), {})
+        cache_key = (model_name, int(primary.get("free_gb", 0) // FREE_VRAM_BUCKET_GB))
+        cached = self._suggestions_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         model_size = self.get_model_size_estimation(model_name)
         quantization_analysis = self.calculate_optimal_quantization(model_size)
         
-        return {
+        result = {
             "model_name": model_name,
             "estimated_size_gb": model_size,
             "quantization_analysis": quantization_analysis,
             "suggestions": self._generate_human_readable_suggestions(quantization_analysis)
         }
+        
+        with self._suggestions_lock:
+            if len(self._suggestions_cache) >= SUGGESTIONS_CACHE_SIZE:
+                # Вытесняем самую старую запись
+                del self._suggestions_cache[next(iter(self._suggestions_cache))]
+            self._suggestions_cache[cache_key] = result
+        return result
+    
+    def warm_suggestions_cache(self, model_names: Tuple[str, ...] = POPULAR_MODELS):
+        """Прогрев кеша рекомендаций (блокирующий, запускается в фоне из lifespan)"""
+        for model_name in model_names:
+            try:
+                self.generate_quantization_suggestions(model_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось прогреть рекомендации для {model_name}: {e}")
+        logger.info(f"🔥 Кеш рекомендаций прогрет: {len(model_names)} моделей")
     
     def _generate_human_readable_suggestions(self, analysis: Dict[str, Any]) -> List[str]:
         """Генерация человеко-читаемых предложений"""
-        suggestions = []
-        
-        model_size = analysis["model_size_gb"]
-        free_vram = analysis["free_vram_gb"]
         best_rec = analysis["best_recommendation"]
+        context = {**best_rec, "model_size": analysis["model_size_gb"], "free_vram": analysis["free_vram_gb"]}
         
-        suggestions.append(f"💾 Размер модели: {model_size} GB")
-        suggestions.append(f"🎮 Доступно VRAM: {free_vram} GB")
-        
-        if analysis["can_load"]:
-            suggestions.append(f"✅ Рекомендуется: {best_rec['level']} ({best_rec['bits']}-bit)")
-            suggestions.append(f"📊 Качество: {best_rec['quality']}")
-            suggestions.append(f"🔮 Займет VRAM: ~{best_rec['estimated_size_gb']} GB")
-        else:
-            suggestions.append(f"⚠️  Модель не влезает в доступную память")
-            suggestions.append(f"💡 Можно попробовать: {best_rec['level']} ({best_rec['bits']}-bit)")
-            suggestions.append(f"🔮 Потребуется: ~{best_rec['required_vram_gb']} GB")
-            suggestions.append("🚨 Возможны проблемы с производительностью")
+        templates = SUGGESTION_HEADER + (SUGGESTIONS_CAN_LOAD if analysis["can_load"] else SUGGESTIONS_CANNOT_LOAD)
+        suggestions = [template.format_map(context) for template in templates]
         
         # Альтернативные варианты
         alt_options = [rec for rec in analysis["recommendations"] if rec["can_fit"] and rec != best_rec]
         if alt_options:
             suggestions.append("\n🔧 Альтернативные варианты:")
             for opt in alt_options[:2]:  # Показываем только 2 лучших альтернативы
-                suggestions.append(f"   • {opt['level']} ({opt['bits']}-bit) - {opt['estimated_size_gb']} GB")
+                suggestions.append(ALTERNATIVE_SUGGESTION.format_map(opt))
         
         return suggestions
     
+    def _ensure_cache_dir(self):
+        """Создает папку квантованных моделей (вместе с родителями) один раз"""
+        if not self._cache_dir_ready:
+            self.quantized_models_cache.mkdir(parents=True, exist_ok=True)
+            self._cache_dir_ready = True
+    
     def get_quantized_model_path(self, model_name: str, quantization_level: str) -> Path:
         """
         Получение пути для квантованной версии модели
@@ -241,6 +409,23 @@ class QuantizationService:
         safe_name = model_name.replace('/', '--')
         return self.quantized_models_cache / f"{safe_name}--{quantization_level}"
     
+    def get_directory_size_mb(self, directory: Path) -> float:
+        """
+        Размер папки в MB, обход через os.scandir без Path-объекта на каждый файл
+        Не кешируется: перезапись файла или вложенной папки не меняет mtime корня
+        """
+        total = 0
+        stack = [str(directory)]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        
+        return round(total / (1024**2), 2)
+    
     def is_model_quantized(self, model_name: str, quantization_level: str) -> bool:
         """
         Проверка существует ли уже квантованная версия модели
@@ -279,10 +464,13 @@ class QuantizationService:
             
             # Загружаем модель с квантованием
             logger.info(f"📥 Загрузка модели {model_name}...")
+            # fp16 - только смена типа весов перед save_pretrained: копировать их на GPU незачем,
+            # модель остается на CPU без H2D-копий. bitsandbytes квантует при загрузке на GPU
             model = AutoModelForCausalLM.from_pretrained(
                 model_name,
                 quantization_config=bnb_config,
-                device_map="auto",
+                device_map="cpu" if bnb_config is None else "auto",
+                low_cpu_mem_usage=True,
                 trust_remote_code=True,
                 torch_dtype=torch.float16 if quantization_level == 'fp16' else None
             )
@@ -290,6 +478,7 @@ class QuantizationService:
             logger.info(f"✅ Модель успешно загружена с квантованием")
             
             # Сохраняем квантованную модель
+            self._ensure_cache_dir()
             quantized_path = self.get_quantized_model_path(model_name, quantization_level)
             logger.info(f"💾 Сохранение квантованной модели в {quantized_path}...")
             model.save_pretrained(quantized_path)
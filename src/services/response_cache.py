@@ -0,0 +1,113 @@
+# src/services/response_cache.py
+"""
+In-memory кеш ответов моделей
+Ключ - SHA-256 от входных данных, вытеснение по LRU и по времени жизни
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from loguru import logger
+
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 1024))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get('LLM_CACHE_TTL_SECONDS', 3600))
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 50000))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get('EMBEDDING_CACHE_TTL_SECONDS', 3600))
+
+class ResponseCache:
+    """LRU-кеш с TTL; одинаковые одновременные запросы считаются один раз"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # Ключ -> задача, которая сейчас считает значение; ее ждут все одинаковые запросы
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """SHA-256 от входных данных: в памяти не храним сами тексты запросов"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Значение из кеша или None"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        """Сохраняет значение, вытесняя самые старые записи"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_compute(self, key: str, coro_factory: Callable[[], Awaitable[Any]],
+                             cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Возвращает значение из кеша или вычисляет его через coro_factory()
+        cacheable решает, можно ли сохранять результат (например, не кешируем ошибки)
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        # Вычисление идет в отдельной задаче, общей для одинаковых запросов:
+        # отключение первого клиента не отменяет ответ для остальных
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, coro_factory, cacheable))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._compute_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, coro_factory: Callable[[], Awaitable[Any]],
+                       cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        value = await coro_factory()
+        if cacheable is None or cacheable(value):
+            self.set(key, value)
+        return value
+
+    def _compute_done(self, key: str, task: asyncio.Task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        # Все ждущие могли отключиться - забираем исключение, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+    def clear(self):
+        self._data.clear()
+        logger.info(f"🧹 Кеш {self.name} очищен")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+# Глобальные экземпляры
+chat_cache = ResponseCache("chat", LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
+embedding_cache = ResponseCache("embeddings", EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_TTL_SECONDS)
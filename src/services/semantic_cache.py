@@ -0,0 +1,127 @@
+# src/services/semantic_cache.py
+"""
+Семантический кеш чат-ответов
+Перефразированные повторы вопроса находятся по косинусной близости эмбеддингов
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+from loguru import logger
+
+from services.embedding_service import embedding_service
+
+# Модель эмбеддингов для сравнения вопросов и порог близости подобраны в паре:
+# 0.80 - порог для all-MiniLM-L6-v2. У e5 косинусы лежат в узкой высокой полосе,
+# с ним несвязанные вопросы проходят 0.80 - при смене модели порог нужно пересчитать
+SEMANTIC_CACHE_MODEL = os.environ.get('SEMANTIC_CACHE_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.80))
+SEMANTIC_CACHE_RETRY_SECONDS = 60.0  # Модели нет в кеше - повторная попытка не чаще раза в минуту
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 10000))
+
+class _VectorIndex:
+    """
+    Кольцевой буфер (эмбеддинг, контекст, ответ) на все контексты сразу:
+    при переполнении затираются самые старые записи, память ограничена capacity
+    """
+
+    def __init__(self, capacity: int, dim: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        # SHA-256 контекста каждой записи: искать можно только среди ответов того же контекста
+        self.scopes = np.zeros(capacity, dtype='S64')
+        self.responses: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.capacity = capacity
+        self.count = 0
+        self.position = 0
+
+    def search(self, query: np.ndarray, scope: bytes):
+        """
+        Лучшее совпадение в контексте scope: (близость, ответ)
+        Векторы нормированы при кодировании, поэтому косинус - это просто dot product
+        """
+        if self.count == 0:
+            return 0.0, None
+        scores = self.vectors[:self.count] @ query
+        scores[self.scopes[:self.count] != scope] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] == -np.inf:
+            return 0.0, None
+        return float(scores[best]), self.responses[best]
+
+    def add(self, vector: np.ndarray, scope: bytes, response: Dict[str, Any]):
+        self.vectors[self.position] = vector
+        self.scopes[self.position] = scope
+        self.responses[self.position] = response
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+class SemanticCache:
+    """Кеш ответов по смыслу последнего сообщения пользователя"""
+
+    def __init__(self, model_name: str = SEMANTIC_CACHE_MODEL, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Пока модель недоступна, чат работает без семантического кеша
+        self._unavailable_until = 0.0
+        # Один индекс на все контексты: буфер выделяется при первой записи, когда известна размерность
+        self._index: Optional[_VectorIndex] = None
+
+    @staticmethod
+    def _scope(model_name: str, max_tokens: int, messages: List[Dict[str, str]]) -> bytes:
+        """
+        Ответ можно переиспользовать только для той же модели, того же лимита токенов
+        (иначе отдадим ответ, обрезанный по меньшему max_tokens) и того же контекста:
+        сравниваем по смыслу лишь последнее сообщение, предыдущие должны совпадать точно
+        """
+        raw = json.dumps([model_name, max_tokens, messages[:-1]], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest().encode('ascii')
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            embeddings = await embedding_service.encode_normalized([text], self.model_name)
+        except Exception as e:
+            logger.error(f"Semantic cache embedding error: {e}")
+            return None
+        if embeddings is None:
+            logger.warning(f"⚠️ Семантический кеш: модель {self.model_name} недоступна, кеш пропускается")
+            self._unavailable_until = time.monotonic() + SEMANTIC_CACHE_RETRY_SECONDS
+            return None
+        return embeddings[0]
+
+    async def get_or_compute(self, model_name: str, max_tokens: int, messages: List[Dict[str, str]],
+                             coro_factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Ответ на близкий по смыслу вопрос из кеша или новый ответ модели"""
+        if not messages or messages[-1].get("role") != "user":
+            return await coro_factory()
+
+        query = await self._embed(messages[-1].get("content", ""))
+        if query is None:
+            # Модель эмбеддингов недоступна - работаем без семантического кеша
+            return await coro_factory()
+
+        scope = self._scope(model_name, max_tokens, messages)
+        index = self._index
+        if index is not None and index.vectors.shape[1] == query.shape[0]:
+            score, response = index.search(query, scope)
+            if response is not None and score > self.threshold:
+                logger.debug(f"🎯 Семантический кеш: попадание, близость {score:.3f}")
+                return response
+
+        result = await coro_factory()
+        if "error" not in result:
+            index = self._index
+            if index is None or index.vectors.shape[1] != query.shape[0]:
+                # Первая запись или сменилась модель эмбеддингов - старые векторы несравнимы
+                index = self._index = _VectorIndex(self.max_entries, query.shape[0])
+            index.add(query, scope, result)
+        return result
+
+# Глобальный экземпляр
+semantic_cache = SemanticCache()